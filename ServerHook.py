@@ -1,17 +1,102 @@
 import os
+import sys
 import time
 import unicodedata
 import random
 import requests
 import re
+import json
+import atexit
+import hmac
+import hashlib
+import threading
 from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort
+
+from journal_sesiones import JournalSesiones
+from motor_flujos import MotorFlujos
+from indice_huellas import IndiceHuellas
+from rut import normalizar_rut, variantes_rut
+from cola_lotes import ColaLotes
+from coalescedor import CoalescedorMensajes
 
 app = Flask(__name__)
 
 # ===================== SESIONES EN MEMORIA =====================
 
-sessions = {}
+# Una sesión expira tras SESSION_TTL_HORAS sin mensajes, o antes (SESSION_TTL_TERMINADA_MIN)
+# si quedó terminada: de vuelta en el menú y sin datos de un formulario a medias.
+SESSION_TTL_SEG = float(os.environ.get("SESSION_TTL_HORAS", 24)) * 3600
+SESSION_TTL_TERMINADA_SEG = float(os.environ.get("SESSION_TTL_TERMINADA_MIN", 30)) * 60
+SESSION_PURGA_SEG = 600
+ESTADOS_TERMINADOS = ("inicio", "menu_principal")
+
+
+def vencimiento_sesion(session: dict) -> float:
+    # Sesiones guardadas antes de registrar la actividad: cuentan desde ahora
+    ultima = session.setdefault("ultima_actividad", time.time())
+    terminada = session.get("state") in ESTADOS_TERMINADOS and not session.get("data")
+    return ultima + (SESSION_TTL_TERMINADA_SEG if terminada else SESSION_TTL_SEG)
+
+
+def sesion_expirada(session: dict, ahora: float) -> bool:
+    return vencimiento_sesion(session) < ahora
+
+
+# Journal en SQLite para que las sesiones sobrevivan al reinicio del proceso.
+# SESSION_JOURNAL_PATH es obligatoria ("" lo deshabilita a propósito) y tiene que apuntar a
+# almacenamiento que sobreviva al reinicio de la máquina (un volumen montado). El disco de un
+# dyno de Heroku se borra en cada restart/deploy: ahí el journal solo cubre la re-creación del
+# worker dentro del mismo dyno, no los deploys.
+if "SESSION_JOURNAL_PATH" not in os.environ:
+    raise RuntimeError(
+        "Falta SESSION_JOURNAL_PATH: ruta del journal de sesiones en almacenamiento persistente "
+        '(SESSION_JOURNAL_PATH="" para correr sin journal)'
+    )
+SESSION_JOURNAL_PATH = os.environ["SESSION_JOURNAL_PATH"]
+if SESSION_JOURNAL_PATH and os.environ.get("DYNO"):
+    print(f"ADVERTENCIA: journal de sesiones en {SESSION_JOURNAL_PATH}, disco efímero del dyno: "
+          "las sesiones se pierden en cada restart/deploy")
+journal_sesiones = JournalSesiones(
+    SESSION_JOURNAL_PATH,
+    intervalo_flush=int(os.environ.get("SESSION_JOURNAL_FLUSH_MS", 200)) / 1000,
+    vencimiento=vencimiento_sesion,
+)
+atexit.register(journal_sesiones.cerrar)
+
+sessions = journal_sesiones.restaurar()
+proxima_purga_sesiones = time.time() + SESSION_PURGA_SEG
+purga_lock = threading.Lock()
+
+
+def purgar_sesiones_si_toca() -> None:
+    """Cada SESSION_PURGA_SEG quita de memoria (y del journal) las sesiones expiradas."""
+    global proxima_purga_sesiones
+    ahora = time.time()
+    with purga_lock:
+        if ahora < proxima_purga_sesiones:
+            return
+        proxima_purga_sesiones = ahora + SESSION_PURGA_SEG
+
+    vencidas = 0
+    for visitor_id, session in list(sessions.items()):
+        if sesion_expirada(session, ahora) and sessions.get(visitor_id) is session:
+            del sessions[visitor_id]
+            journal_sesiones.registrar(visitor_id, None)
+            vencidas += 1
+    if vencidas:
+        print(f"[sesiones] {vencidas} sesiones expiradas descartadas; quedan {len(sessions)}")
+
+
+def mantenimiento_pendiente(motor: MotorFlujos = None) -> bool:
+    """True si a mantenimiento() le toca trabajar (la entrada ASGI lo corre entonces fuera del event loop)."""
+    return time.time() >= proxima_purga_sesiones or (motor or motor_flujos).revision_pendiente()
+
+
+def mantenimiento(motor: MotorFlujos = None) -> None:
+    """Purga de sesiones expiradas y recarga de flujos si cambiaron; cada una se limita a su intervalo."""
+    purgar_sesiones_si_toca()
+    (motor or motor_flujos).recargar_si_cambio()
 
 
 def get_visitor_id(payload: dict) -> str:
@@ -42,17 +127,6 @@ def build_reply(texts, input_card=None, action="reply") -> dict:
     return response
 
 
-def reply_menu_principal() -> dict:
-    """Respuesta de menú principal con botones (select)."""
-    return build_reply(
-        [
-            "¡Bienvenido! Gracias por contactar con Selec.",
-            "Por favor, seleccione una de las siguientes opciones para atender su solicitud.",
-        ],
-        input_card={"type": "select", "options": ["Solicitud Cotización", "Servicio PostVenta"]},
-    )
-
-
 def normalizar_texto(txt: str) -> str:
     """Normaliza texto (minúsculas y sin acentos) para comparar opciones."""
     if not txt:
@@ -67,12 +141,35 @@ def normalizar_texto(txt: str) -> str:
 
 # ===================== INTEGRACIÓN ZOHO CRM =====================
 
-CRM_BASE = "https://www.zohoapis.com/crm/v2.1"
-ACCOUNTS_BASE = "https://accounts.zoho.com"
+CRM_BASE = os.environ.get("ZOHO_CRM_BASE", "https://www.zohoapis.com/crm/v2.1")
+ACCOUNTS_BASE = os.environ.get("ZOHO_ACCOUNTS_BASE", "https://accounts.zoho.com")
+
+OWNERS_POSIBLES = [
+    {"nombre": "Maria Rengifo", "id": "4358923000003278018", "email": "maria@selec.cl"},
+    {"nombre": "Joaquin Gonzalez", "id": "4358923000011940001", "email": "joaquin@selec.cl"},
+]
 
 access_token_cache = {"token": None, "expires_at": 0.0}
 
 
+def parametros_refresh_token():
+    """Parámetros OAuth para renovar el access token, o None si faltan credenciales."""
+    client_id = os.environ.get("ZOHO_CLIENT_ID")
+    client_secret = os.environ.get("ZOHO_CLIENT_SECRET")
+    refresh_token = os.environ.get("ZOHO_REFRESH_TOKEN")
+
+    if not client_id or not client_secret or not refresh_token:
+        print("ERROR: faltan ZOHO_CLIENT_ID / ZOHO_CLIENT_SECRET / ZOHO_REFRESH_TOKEN.")
+        return None
+
+    return {
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "refresh_token",
+    }
+
+
 def get_access_token() -> str:
     """
     Devuelve un access token válido usando refresh_token si es necesario.
@@ -85,21 +182,11 @@ def get_access_token() -> str:
     if access_token_cache["token"] and (access_token_cache["expires_at"] - 60 > now):
         return access_token_cache["token"]
 
-    client_id = os.environ.get("ZOHO_CLIENT_ID")
-    client_secret = os.environ.get("ZOHO_CLIENT_SECRET")
-    refresh_token = os.environ.get("ZOHO_REFRESH_TOKEN")
-
-    if not client_id or not client_secret or not refresh_token:
-        print("ERROR: faltan ZOHO_CLIENT_ID / ZOHO_CLIENT_SECRET / ZOHO_REFRESH_TOKEN.")
+    params = parametros_refresh_token()
+    if params is None:
         return None
 
     url = f"{ACCOUNTS_BASE}/oauth/v2/token"
-    params = {
-        "refresh_token": refresh_token,
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "refresh_token",
-    }
 
     try:
         resp = requests.post(url, params=params, timeout=10)
@@ -126,12 +213,62 @@ def get_access_token() -> str:
         return None
 
 
+def buscar_account_por_rut(rut: str, headers: dict):
+    """
+    Busca un Account por Billing_Code (RUT canónico), incluyendo formatos antiguos
+    (con puntos / sin guión). Devuelve su ID o None.
+    """
+    try:
+        criteria = "(" + "or".join(f"(Billing_Code:equals:{v})" for v in variantes_rut(rut)) + ")"
+        search_url = f"{CRM_BASE}/Accounts/search"
+        params = {"criteria": criteria}
+        resp = requests.get(search_url, headers=headers, params=params, timeout=10)
+        print("=== Búsqueda Account por Billing_Code ===")
+        print(resp.status_code, resp.text)
+
+        if resp.status_code == 200:
+            data = resp.json()
+            registros = data.get("data") or []
+            if registros:
+                account_id = registros[0].get("id")
+                if account_id:
+                    print(f"[buscar_account_por_rut] Account encontrado ID={account_id}")
+                    return account_id
+        elif resp.status_code != 204:
+            print("[buscar_account_por_rut] Error en búsqueda:", resp.status_code, resp.text)
+    except Exception as e:
+        print("ERROR buscando Account:", e)
+
+    return None
+
+
+def construir_account_data(empresa: str, rut: str, telefono: str, owner: dict) -> dict:
+    return {
+        "Account_Name": empresa or rut or "Sin nombre",
+        "Billing_Code": rut or None,
+        "Phone": telefono or None,
+        "Cliente_Selec": "NO",
+        "Owner": {"id": owner["id"]},
+        "Industry": "Por definir",
+        "Region1": "Por definir",
+        "Ciudad_I": "Por definir",
+        "Website": "https://pordefinir.com",
+    }
+
+
 def obtener_o_crear_account(campos: dict):
     """
     Busca un Account por Billing_Code (RUT).
     Si existe, devuelve su ID.
-    Si no existe, crea uno nuevo.
+    Si no existe, crea uno nuevo (con el RUT en formato canónico).
+    Un RUT con dígito verificador inválido se rechaza antes de llamar a Zoho.
     """
+    rut_original = (campos.get("rut") or "").strip()
+    rut = normalizar_rut(rut_original) or ""
+    if rut_original and not rut:
+        print(f"[obtener_o_crear_account] RUT inválido {rut_original!r}; no se busca/crea Account.")
+        return None
+
     access_token = get_access_token()
     if not access_token:
         print("No se pudo obtener access token; se omite Accounts.")
@@ -142,7 +279,6 @@ def obtener_o_crear_account(campos: dict):
         "Content-Type": "application/json",
     }
 
-    rut = (campos.get("rut") or "").strip()
     empresa = (campos.get("empresa") or "").strip()
     telefono = (campos.get("telefono") or "").strip()
 
@@ -152,49 +288,17 @@ def obtener_o_crear_account(campos: dict):
         print("[obtener_o_crear_account] Sin RUT ni empresa, no se crea/busca Account.")
         return None
 
-    owners_posibles = [
-        {"name": "Maria Rengifo", "id": "4358923000003278018"},
-        {"name": "Joaquin Gonzalez", "id": "4358923000011940001"},
-    ]
-    owner_elegido = random.choice(owners_posibles)
-    print(f"Owner elegido para Account: {owner_elegido['name']} ({owner_elegido['id']})")
+    owner_elegido = random.choice(OWNERS_POSIBLES)
+    print(f"Owner elegido para Account: {owner_elegido['nombre']} ({owner_elegido['id']})")
 
     # 1) Buscar por Billing_Code (RUT)
     if rut:
-        try:
-            criteria = f"(Billing_Code:equals:{rut})"
-            search_url = f"{CRM_BASE}/Accounts/search"
-            params = {"criteria": criteria}
-            resp = requests.get(search_url, headers=headers, params=params, timeout=10)
-            print("=== Búsqueda Account por Billing_Code ===")
-            print(resp.status_code, resp.text)
-
-            if resp.status_code == 200:
-                data = resp.json()
-                registros = data.get("data") or []
-                if registros:
-                    account_id = registros[0].get("id")
-                    if account_id:
-                        print(f"[obtener_o_crear_account] Account encontrado ID={account_id}")
-                        return account_id
-            else:
-                print("[obtener_o_crear_account] Error en búsqueda:", resp.status_code, resp.text)
-        except Exception as e:
-            print("ERROR buscando Account:", e)
+        account_id = buscar_account_por_rut(rut, headers)
+        if account_id:
+            return account_id
 
     # 2) Crear Account nuevo
-    account_name = empresa or rut or "Sin nombre"
-    account_data = {
-        "Account_Name": account_name,
-        "Billing_Code": rut or None,
-        "Phone": telefono or None,
-        "Cliente_Selec": "NO",
-        "Owner": {"id": owner_elegido["id"]},
-        "Industry": "Por definir",
-        "Region1": "Por definir",
-        "Ciudad_I": "Por definir",
-        "Website": "https://pordefinir.com",
-    }
+    account_data = construir_account_data(empresa, rut, telefono, owner_elegido)
 
     create_url = f"{CRM_BASE}/Accounts"
     payload = {"data": [account_data]}
@@ -265,23 +369,12 @@ CC_GERENCIA_EMAIL = "gerencia@selec.cl"
 CRM_ORG_UI = "org706345205"
 
 
-def enviar_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict):
-    access_token = get_access_token()
-    if not access_token:
-        print("[enviar_correo_owner] No se pudo obtener access token; no se envía correo.")
-        return None
-
-    url = f"{CRM_BASE}/Deals/{deal_id}/actions/send_mail"
-    headers = {
-        "Authorization": f"Zoho-oauthtoken {access_token}",
-        "Content-Type": "application/json",
-    }
-
+def construir_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict):
+    """Payload de send_mail para avisar al owner del Deal (None si el owner no tiene email)."""
     to_email = owner.get("email")
     to_name = owner.get("nombre", "Ejecutivo")
 
     if not to_email:
-        print("[enviar_correo_owner] Owner sin email definido, no se envía correo.")
         return None
 
     subject = f"Nuevo Deal asignado desde WhatsApp: {deal_name}"
@@ -307,7 +400,7 @@ def enviar_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict)
     <p>Saludos,<br/>Bot WhatsApp Selec</p>
     """
 
-    payload = {
+    return {
         "data": [
             {
                 "from": {"id": SENDER_USER_ID, "user_name": SENDER_USER_NAME, "email": SENDER_USER_EMAIL},
@@ -320,6 +413,24 @@ def enviar_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict)
         ]
     }
 
+
+def enviar_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict):
+    payload = construir_correo_owner(owner, deal_id, deal_name, campos)
+    if payload is None:
+        print("[enviar_correo_owner] Owner sin email definido, no se envía correo.")
+        return None
+
+    access_token = get_access_token()
+    if not access_token:
+        print("[enviar_correo_owner] No se pudo obtener access token; no se envía correo.")
+        return None
+
+    url = f"{CRM_BASE}/Deals/{deal_id}/actions/send_mail"
+    headers = {
+        "Authorization": f"Zoho-oauthtoken {access_token}",
+        "Content-Type": "application/json",
+    }
+
     try:
         resp = requests.post(url, headers=headers, json=payload, timeout=10)
         print("=== Respuesta Zoho CRM send_mail ===")
@@ -330,31 +441,14 @@ def enviar_correo_owner(owner: dict, deal_id: str, deal_name: str, campos: dict)
         return None
 
 
-def crear_deal_en_zoho(campos: dict, account_id: str = None):
-    access_token = get_access_token()
-    if not access_token:
-        print("No se pudo obtener access token de Zoho; se omite creación de Deal.")
-        return None
-
+def construir_deal_data(campos: dict, owner: dict, account_id: str = None):
+    """Devuelve (deal_name, deal_data) para insertar en Deals."""
     ahora = datetime.now().astimezone()
     manana = ahora + timedelta(days=1)
     fecha_hora_1_str = manana.isoformat(timespec="seconds")
     fecha_limite_oferta = manana.date()
     closing_date_str = calcular_closing_date(fecha_limite_oferta)
 
-    url = f"{CRM_BASE}/Deals"
-    headers = {
-        "Authorization": f"Zoho-oauthtoken {access_token}",
-        "Content-Type": "application/json",
-    }
-
-    owners_posibles = [
-        {"nombre": "Maria Rengifo", "id": "4358923000003278018", "email": "maria@selec.cl"},
-        {"nombre": "Joaquin Gonzalez", "id": "4358923000011940001", "email": "joaquin@selec.cl"},
-    ]
-    owner_elegido = random.choice(owners_posibles)
-    print(f"Owner elegido para el Deal: {owner_elegido['nombre']} ({owner_elegido['id']})")
-
     deal_name = f"Cotización - {campos.get('empresa') or 'Sin empresa'}"
 
     deal_data = {
@@ -368,13 +462,15 @@ def crear_deal_en_zoho(campos: dict, account_id: str = None):
             f"Producto / descripción: {campos.get('num_parte')}\n"
             f"Marca: {campos.get('marca')}\n"
             f"Cantidad: {campos.get('cantidad')}\n"
-            f"Dirección de entrega: {campos.get('direccion_entrega')}"
+            f"Dirección de entrega: {campos.get('direccion_entrega')}\n"
+            # reconciliar.py identifica el Deal por esta línea aunque se edite el resto del texto
+            f"Huella: {huella_cotizacion(campos)}"
         ),
         "Stage": "Pendiente por cotizar",
         "Lead_Source": "Chat Whatsapp",
         "Amount": "1",
-        "Owner": {"id": owner_elegido["id"]},
-        "Asignado_a": {"id": owner_elegido["id"]},
+        "Owner": {"id": owner["id"]},
+        "Asignado_a": {"id": owner["id"]},
         "Type": "Industrias",
         "Fecha_hora_1": fecha_hora_1_str,
         "Closing_Date": closing_date_str,
@@ -383,6 +479,25 @@ def crear_deal_en_zoho(campos: dict, account_id: str = None):
     if account_id:
         deal_data["Account_Name"] = {"id": account_id}
 
+    return deal_name, deal_data
+
+
+def crear_deal_en_zoho(campos: dict, account_id: str = None):
+    access_token = get_access_token()
+    if not access_token:
+        print("No se pudo obtener access token de Zoho; se omite creación de Deal.")
+        return None
+
+    url = f"{CRM_BASE}/Deals"
+    headers = {
+        "Authorization": f"Zoho-oauthtoken {access_token}",
+        "Content-Type": "application/json",
+    }
+
+    owner_elegido = random.choice(OWNERS_POSIBLES)
+    print(f"Owner elegido para el Deal: {owner_elegido['nombre']} ({owner_elegido['id']})")
+
+    deal_name, deal_data = construir_deal_data(campos, owner_elegido, account_id)
     payload = {"data": [deal_data]}
 
     try:
@@ -409,6 +524,286 @@ def crear_deal_en_zoho(campos: dict, account_id: str = None):
         return None
 
 
+def id_registro_creado(resp):
+    """Extrae el ID del primer registro creado de una respuesta de inserción de Zoho (o None)."""
+    if resp is None or resp.status_code not in (200, 201):
+        return None
+    try:
+        registros = resp.json().get("data") or []
+    except Exception:
+        return None
+    if not registros:
+        return None
+    return (registros[0].get("details") or {}).get("id")
+
+
+def construir_nota_repetida(campos: dict) -> dict:
+    ahora = datetime.now().astimezone().isoformat(timespec="seconds")
+    return {
+        "data": [
+            {
+                "Note_Title": "Solicitud repetida desde WhatsApp",
+                "Note_Content": (
+                    f"El cliente reenvió la misma solicitud ({ahora}).\n"
+                    f"Contacto: {campos.get('contacto')}\n"
+                    f"Correo: {campos.get('correo')}\n"
+                    f"Teléfono: {campos.get('telefono')}\n"
+                    f"Marca: {campos.get('marca')}\n"
+                    f"Dirección de entrega: {campos.get('direccion_entrega')}"
+                ),
+            }
+        ]
+    }
+
+
+def agregar_nota_a_deal(deal_id: str, campos: dict):
+    """Agrega una nota al Deal existente (se usa para cotizaciones repetidas)."""
+    access_token = get_access_token()
+    if not access_token:
+        print("[agregar_nota_a_deal] No se pudo obtener access token; no se agrega nota.")
+        return None
+
+    url = f"{CRM_BASE}/Deals/{deal_id}/Notes"
+    headers = {
+        "Authorization": f"Zoho-oauthtoken {access_token}",
+        "Content-Type": "application/json",
+    }
+
+    payload = construir_nota_repetida(campos)
+
+    try:
+        resp = requests.post(url, headers=headers, json=payload, timeout=10)
+        print("=== Respuesta Zoho CRM (Notes) ===")
+        print(resp.status_code, resp.text)
+        return resp
+    except Exception as e:
+        print("ERROR agregando nota al Deal:", e)
+        return None
+
+
+# ===================== Casos de postventa (inserción en lotes) =====================
+#
+# Las solicitudes de postventa se encolan desde el webhook y un hilo de fondo las
+# inserta en POSTVENTA_MODULO (por defecto Cases) de a lotes de hasta 100 registros
+# (máximo por llamada de Zoho), reintentando ante 429 / 5xx.
+
+POSTVENTA_MODULO = os.environ.get("POSTVENTA_MODULO", "Cases")
+POSTVENTA_REINTENTOS = 4
+# Los casos que no llegan a Zoho se recrean desde sus líneas CAPTURA_POSTVENTA del log
+POSTVENTA_RECUPERACION = "recuperables con reconciliar.py --postventa sobre el log de la app"
+
+accounts_por_rut = IndiceHuellas(ventana_seg=3600, max_entradas=5000)
+
+
+def construir_case_data(campos: dict, account_id: str = None) -> dict:
+    case_data = {
+        "Subject": f"Postventa WhatsApp - Factura {campos.get('numero_factura')}",
+        "Description": (
+            f"Nombre: {campos.get('nombre')}\n"
+            f"RUT: {campos.get('rut')}\n"
+            f"Número de factura: {campos.get('numero_factura')}\n"
+            f"Descripción del problema: {campos.get('detalle') or '(sin detalle adicional)'}\n"
+            # reconciliar.py --postventa identifica el caso por esta línea
+            f"Huella: {huella_postventa(campos)}"
+        ),
+        "Status": "New",
+        "Case_Origin": "Chat Whatsapp",
+    }
+    if account_id:
+        case_data["Account_Name"] = {"id": account_id}
+    return case_data
+
+
+def insertar_cases_en_lote(lote: list) -> None:
+    """Resuelve Accounts por RUT (con caché) e inserta el lote en una sola llamada multi-registro."""
+    access_token = get_access_token()
+    if not access_token:
+        print(f"[insertar_cases_en_lote] Sin access token; {len(lote)} casos de postventa sin crear "
+              f"({POSTVENTA_RECUPERACION}).")
+        return
+
+    headers = {
+        "Authorization": f"Zoho-oauthtoken {access_token}",
+        "Content-Type": "application/json",
+    }
+
+    registros = []
+    for campos in lote:
+        rut = normalizar_rut(campos.get("rut"))
+        account_id = None
+        if rut:
+            account_id = accounts_por_rut.buscar(rut)
+            if account_id is None:
+                account_id = buscar_account_por_rut(rut, headers)
+                if account_id:
+                    accounts_por_rut.registrar(rut, account_id)
+        registros.append(construir_case_data(campos, account_id))
+
+    resultados = insertar_registros(POSTVENTA_MODULO, registros, headers, reintentos=POSTVENTA_REINTENTOS)
+    if resultados is None:
+        print(f"[insertar_cases_en_lote] No se pudo insertar lote de {len(registros)} casos "
+              f"({POSTVENTA_RECUPERACION}): {registros}")
+        return
+
+    for registro, resultado in zip(registros, resultados):
+        if resultado.get("status") != "success":
+            print(f"[insertar_cases_en_lote] Caso rechazado: {resultado} <- {registro}")
+
+
+def insertar_registros(modulo: str, registros: list, headers: dict, reintentos: int = 4):
+    """
+    Inserción multi-registro (hasta 100 por llamada) con reintentos y backoff ante 429/5xx.
+    Devuelve la lista de resultados de Zoho (uno por registro, en el mismo orden)
+    o None si el lote completo no se pudo insertar.
+    """
+    url = f"{CRM_BASE}/{modulo}"
+    for intento in range(reintentos):
+        try:
+            resp = requests.post(url, headers=headers, json={"data": registros}, timeout=30)
+            print(f"=== Respuesta Zoho CRM ({modulo}, lote de {len(registros)}) ===")
+            print(resp.status_code, resp.text)
+        except Exception as e:
+            print(f"ERROR insertando lote en {modulo}:", e)
+            resp = None
+
+        # 207 = Multi-Status: algunos registros insertados y otros rechazados
+        if resp is not None and resp.status_code in (200, 201, 202, 207):
+            try:
+                return resp.json().get("data") or []
+            except Exception:
+                return []
+
+        if resp is not None and resp.status_code not in (429, 500, 502, 503, 504):
+            break
+        time.sleep(2 ** intento)
+
+    return None
+
+
+cola_postventa = ColaLotes(
+    insertar_cases_en_lote,
+    nombre="cola-postventa",
+    tam_lote=100,
+    espera_max=float(os.environ.get("POSTVENTA_LOTE_ESPERA_SEG", 2)),
+)
+# Parte del apagado dedicada a vaciar colas y journal, después de las peticiones en curso
+# (ver gunicorn.conf.py: entre ambas tienen que caber en los 30 s que Heroku da tras SIGTERM).
+SERVIDOR_DRENAJE_SEG = float(os.environ.get("SERVIDOR_DRENAJE_SEG", 8))
+atexit.register(cola_postventa.detener, timeout=SERVIDOR_DRENAJE_SEG)
+
+
+# ===================== Deduplicación de cotizaciones =====================
+#
+# Misma empresa (RUT) + mismo producto/cantidad dentro de la ventana => se agrega
+# una nota al Deal ya creado en vez de resolver Account, crear Deal y enviar correo.
+
+cotizaciones_recientes = IndiceHuellas(
+    ventana_seg=float(os.environ.get("COTIZACION_DEDUPE_SEG", 900)),
+    max_entradas=int(os.environ.get("COTIZACION_DEDUPE_MAX", 10000)),
+)
+
+
+def huella_cotizacion(campos: dict) -> str:
+    """Hash de RUT normalizado + número de parte + marca + cantidad normalizados."""
+    rut = normalizar_rut(campos.get("rut")) or str(campos.get("rut") or "").strip().upper()
+
+    def texto(clave: str) -> str:
+        return " ".join(normalizar_texto(str(campos.get(clave) or "")).split())
+
+    try:
+        cantidad = f"{float(str(campos.get('cantidad') or '').replace(',', '.')):g}"
+    except ValueError:
+        cantidad = texto("cantidad")
+
+    clave = "|".join([rut, texto("num_parte"), texto("marca"), cantidad])
+    return hashlib.sha1(clave.encode("utf-8")).hexdigest()
+
+
+def huella_postventa(campos: dict) -> str:
+    """Hash de RUT normalizado + número de factura + nombre + detalle normalizados."""
+    rut = normalizar_rut(campos.get("rut")) or str(campos.get("rut") or "").strip().upper()
+    textos = [" ".join(normalizar_texto(str(campos.get(c) or "")).split()) for c in ("numero_factura", "nombre", "detalle")]
+    return hashlib.sha1("|".join([rut] + textos).encode("utf-8")).hexdigest()
+
+
+# ===================== Captura de cotizaciones y postventa =====================
+#
+# Cada cotización completa se escribe en el log de la app antes de llamar a Zoho, y cada
+# caso de postventa antes de encolarlo, como una línea con etiqueta:
+#     CAPTURA_COTIZACION {"ts": ..., "huella": ..., "campos": {...}}
+# El log sale del dyno (log drain / heroku logs), así que sobrevive reinicios y deploys.
+# Si el CRM falla (o se pierde un lote), reconciliar.py los vuelve a crear leyendo el log
+# exportado (con --postventa para los casos). COTIZACIONES_CAPTURA_PATH / POSTVENTA_CAPTURA_PATH
+# agregan además una copia a un archivo (vacías por defecto: solo tienen sentido en un volumen
+# persistente, nunca en el disco efímero de un dyno).
+
+ETIQUETA_CAPTURA_COTIZACION = "CAPTURA_COTIZACION"
+ETIQUETA_CAPTURA_POSTVENTA = "CAPTURA_POSTVENTA"
+COTIZACIONES_CAPTURA_PATH = os.environ.get("COTIZACIONES_CAPTURA_PATH", "")
+POSTVENTA_CAPTURA_PATH = os.environ.get("POSTVENTA_CAPTURA_PATH", "")
+captura_lock = threading.Lock()
+
+
+def capturar(etiqueta: str, ruta: str, huella: str, data: dict) -> None:
+    """Escribe el envío completo (con su huella) en el log y, si hay ruta, en el archivo; nunca interrumpe el webhook."""
+    linea = json.dumps({
+        "ts": datetime.now().astimezone().isoformat(timespec="seconds"),
+        "huella": huella,
+        "campos": data,
+    }, ensure_ascii=False)
+    with captura_lock:
+        # Una sola escritura por línea: capturas de hilos distintos no se intercalan en el log
+        sys.stdout.write(f"{etiqueta} {linea}\n")
+        sys.stdout.flush()
+        if not ruta:
+            return
+        try:
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+        except OSError as e:
+            print(f"ERROR guardando captura en {ruta}:", e)
+
+
+def capturar_cotizacion(data: dict) -> None:
+    capturar(ETIQUETA_CAPTURA_COTIZACION, COTIZACIONES_CAPTURA_PATH, huella_cotizacion(data), data)
+
+
+def capturar_postventa(data: dict) -> None:
+    capturar(ETIQUETA_CAPTURA_POSTVENTA, POSTVENTA_CAPTURA_PATH, huella_postventa(data), data)
+
+
+# ===================== Coalescencia de mensajes =====================
+#
+# En WhatsApp el bloque de un formulario (empresa/RUT/contacto...) suele llegar en
+# varios mensajes sueltos. Mientras el visitante está en un estado de formulario, un
+# mensaje que por sí solo (más lo pendiente) no completa el formulario espera
+# MENSAJES_VENTANA_SEG (0 deshabilita): los que llegan dentro de la ventana se procesan
+# juntos en el request del último y los anteriores responden sin textos, en vez de un
+# "Campos a corregir" por fragmento. Un formulario completo se procesa sin esperar.
+
+coalescedor = CoalescedorMensajes(
+    ventana_seg=float(os.environ.get("MENSAJES_VENTANA_SEG", 1.5)),
+    espera_max_seg=float(os.environ.get("MENSAJES_ESPERA_MAX_SEG", 6)),
+)
+
+
+def preparar_coalescencia(payload: dict, motor: MotorFlujos = None):
+    """
+    None si el mensaje se procesa tal cual; si no, los argumentos (visitor_id, texto, esperar)
+    para coalescedor.esperar_bloque / esperar_bloque_async.
+    """
+    motor = motor or motor_flujos
+    if not coalescedor.habilitado or payload.get("handler") != "message":
+        return None
+    visitor_id = get_visitor_id(payload)
+    session = sessions.get(visitor_id)
+    if session is None or not motor.es_formulario(session.get("state")):
+        return None
+    texto = extraer_mensaje(payload)
+    completo = motor.completaria_formulario(session, coalescedor.con_pendiente(visitor_id, texto))
+    return visitor_id, texto, not completo
+
+
 # ===================== ENDPOINT WEBHOOK SALESIQ =====================
 
 @app.route("/", methods=["GET"])
@@ -422,48 +817,88 @@ def salesiq_webhook():
         return jsonify({"status": "ok", "message": "Use POST desde Zoho SalesIQ"})
 
     payload = request.get_json(force=True, silent=True) or {}
-    handler = payload.get("handler")
     visitor_id = get_visitor_id(payload)
 
-    session = sessions.setdefault(visitor_id, {"state": "inicio", "data": {}})
+    message_text = None
+    coalescencia = preparar_coalescencia(payload)
+    if coalescencia:
+        message_text = coalescedor.esperar_bloque(*coalescencia)
+        if message_text is None:
+            # El bloque lo procesa (y responde) el último mensaje de la ventana
+            return jsonify(build_reply([]))
 
-    print("=== SalesIQ payload ===")
-    print(payload)
+    mantenimiento()
+    respuesta = procesar_payload(payload, message_text=message_text)
+    journal_sesiones.registrar(visitor_id, sessions.get(visitor_id))
+    return jsonify(respuesta)
 
-    if handler == "trigger":
-        session["state"] = "menu_principal"
-        return jsonify(reply_menu_principal())
 
-    if handler == "message":
-        message_text = extraer_mensaje(payload)
-        print("=== mensaje extraído ===", repr(message_text))
-        state = session.get("state", "inicio")
+# /estado expone pid, memoria y colas: solo responde si ESTADO_TOKEN está configurado y la
+# petición trae el mismo token (header X-Estado-Token o ?token=). Si no, 404.
+ESTADO_TOKEN = os.environ.get("ESTADO_TOKEN", "")
+
+
+def estado_autorizado(token) -> bool:
+    return bool(ESTADO_TOKEN) and hmac.compare_digest(str(token or "").encode(), ESTADO_TOKEN.encode())
 
-        if state == "inicio":
-            session["state"] = "menu_principal"
-            return jsonify(reply_menu_principal())
 
-        if state in ("menu_principal", "inicio"):
-            return jsonify(manejar_menu_principal(session, message_text))
+@app.route("/estado", methods=["GET"])
+def estado():
+    if not estado_autorizado(request.headers.get("X-Estado-Token") or request.args.get("token")):
+        abort(404)
+    return jsonify(estado_servidor())
 
-        # Empresa/contacto en un solo bloque; producto en bloque separado
-        if state == "cotizacion_empresa_bloque":
-            return jsonify(manejar_flujo_cotizacion_empresa_bloque(session, message_text))
 
-        if state == "cotizacion_producto_bloque":
-            session["state"] = "cotizacion_bloque"
-            return jsonify(manejar_flujo_cotizacion_bloque(session, message_text))
+def rss_kb() -> int:
+    """Memoria residente actual del proceso (KB); en Linux desde /proc, si no, el pico."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def estado_servidor() -> dict:
+    """Métricas del proceso para pruebas de carga y monitoreo (sesiones, memoria, colas)."""
+    return {
+        "pid": os.getpid(),
+        "sesiones": len(sessions),
+        "rss_kb": rss_kb(),
+        "cotizaciones_recientes": len(cotizaciones_recientes),
+        "postventa_pendientes": cola_postventa.pendientes(),
+        "postventa_descartados": cola_postventa.descartados,
+        "coalescencia": coalescedor.metricas(),
+    }
+
+
+def procesar_payload(payload: dict, motor: MotorFlujos = None, message_text: str = None) -> dict:
+    """
+    Aplica el payload de SalesIQ a la sesión del visitante y devuelve la respuesta para Zobot.
+    `motor` permite usar otro registro de hooks (p. ej. la entrada ASGI); por defecto, motor_flujos.
+    `message_text` reemplaza al texto del payload (bloque ya coalescido).
+    """
+    motor = motor or motor_flujos
+    handler = payload.get("handler")
+    visitor_id = get_visitor_id(payload)
 
-        if state == "cotizacion_bloque":
-            return jsonify(manejar_flujo_cotizacion_bloque(session, message_text))
+    session = sessions.setdefault(visitor_id, {"state": "inicio", "data": {}})
+    session["ultima_actividad"] = time.time()
 
-        if state == "postventa_bloque":
-            return jsonify(manejar_flujo_postventa_bloque(session, message_text))
+    print("=== SalesIQ payload ===")
+    print(payload)
 
-        session["state"] = "menu_principal"
-        return jsonify(reply_menu_principal())
+    if handler != "message":
+        message_text = ""
+    else:
+        if message_text is None:
+            message_text = extraer_mensaje(payload)
+        print("=== mensaje extraído ===", repr(message_text))
 
-    return jsonify(build_reply("He recibido su mensaje."))
+    return motor.procesar(session, handler, message_text)
 
 
 def extraer_mensaje(payload: dict) -> str:
@@ -482,59 +917,22 @@ def extraer_mensaje(payload: dict) -> str:
     return ""
 
 
-def manejar_menu_principal(session: dict, message_text: str) -> dict:
-    texto_norm = normalizar_texto(message_text)
-
-    if ("cotiz" in texto_norm or "solicitud cotizacion" in texto_norm or texto_norm == "cotizacion"):
-        session["state"] = "cotizacion_empresa_bloque"
-        session["data"] = {}
-        return build_reply(
-            [
-                "Perfecto, trabajaremos en su solicitud de cotización.",
-                (
-                    "Por favor, complete los siguientes datos de la empresa y del contacto "
-                    "en un solo mensaje (puede copiar y pegar este formato):\n\n"
-                    "Nombre de la empresa:\n"
-                    "RUT:\n"
-                    "Nombre de contacto:\n"
-                    "Correo:\n"
-                    "Teléfono:"
-                ),
-            ]
-        )
-
-    if ("postventa" in texto_norm or "post venta" in texto_norm or "servicio postventa" in texto_norm):
-        session["state"] = "postventa_bloque"
-        formulario = (
-            "Perfecto, trabajaremos en su solicitud de postventa.\n"
-            "Por favor, responda copiando y completando este formulario en un solo mensaje:\n\n"
-            "Nombre:\n"
-            "RUT:\n"
-            "Número de factura:\n"
-            "Descripción del problema:"
-        )
-        return build_reply(formulario)
-
-    session["state"] = "derivado_operador"
-    return {
-        "action": "forward",
-        "replies": [
-            "En este momento no puedo gestionar esta solicitud automáticamente.",
-            "Le derivaré con un ejecutivo para que pueda asistirle.",
-        ],
-    }
+# ===================== PARSERS / VALIDADORES DE FLUJOS =====================
+#
+# Los estados, prompts y transiciones viven en flujos.json; aquí solo queda la
+# lógica de parseo/validación que el motor invoca por nombre.
+
+RUT_INVALIDO = "RUT (dígito verificador inválido)"
 
 
-# ===================== CAMBIO SOLICITADO AQUÍ =====================
-def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) -> dict:
+def parsear_empresa_contacto(data: dict, message_text: str) -> dict:
     """
     Etapa 1 (un solo mensaje): empresa + rut + contacto + correo + teléfono.
     Acepta:
       - Formato con etiquetas (Empresa:..., RUT:..., etc.)
       - Texto libre por líneas (sin etiquetas), asignando por heurísticas y, si corresponde, por orden.
-    Luego solicita producto en etapa 2 (mensaje separado).
+    Luego se solicita producto en etapa 2 (mensaje separado).
     """
-    data = session.setdefault("data", {})
     texto = (message_text or "").strip()
     lineas = [l.strip() for l in texto.splitlines() if l.strip()]
 
@@ -554,13 +952,15 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
     def limpiar_digitos(s: str) -> str:
         return re.sub(r"\D", "", s or "")
 
-    def es_rut_plausible(s: str) -> bool:
-        # Acepta RUT con o sin puntos/guión y también solo dígitos (7 a 12) para tolerancia.
+    def es_rut_con_formato(s: str) -> bool:
+        # Con guión antes del DV (y miles con punto, espacio o nada) es un RUT aunque el DV
+        # esté mal: se guarda igual para que el validador pida corregir el dígito verificador.
+        return bool(re.search(r"\d{1,3}[.\s]?\d{3}[.\s]?\d{3}\s*-\s*[\dkK]\b", s or ""))
+
+    def parece_celular(s: str) -> bool:
+        # 9XXXXXXXX / 569XXXXXXXX / +56...: un celular cuyo último dígito coincide con un DV no es un RUT
         s_norm = (s or "").strip()
-        if re.search(r"\d{1,3}\.?\d{3}\.?\d{3}-[\dkK]", s_norm):
-            return True
-        d = limpiar_digitos(s_norm)
-        return 7 <= len(d) <= 12
+        return s_norm.startswith("+") or bool(re.fullmatch(r"(56)?9\d{8}", limpiar_digitos(s_norm)))
 
     def es_telefono_plausible(s: str) -> bool:
         # Acepta teléfono 5 a 12 dígitos (tolerante para evitar bloquear por errores).
@@ -580,7 +980,7 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
             if "empresa" in etiqueta_norm or "razon social" in etiqueta_norm or "razon_social" in etiqueta_norm:
                 campos["empresa"] = valor_clean
             elif etiqueta_norm in ("rut", "r.u.t", "r u t"):
-                campos["rut"] = valor_clean
+                campos["rut"] = normalizar_rut(valor_clean) or valor_clean
             elif "contacto" in etiqueta_norm:
                 campos["contacto"] = valor_clean
             elif "correo" in etiqueta_norm or "email" in etiqueta_norm:
@@ -601,13 +1001,20 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
                 sin_label.remove(linea)
 
     for linea in list(sin_label):
-        if not campos["rut"] and es_rut_plausible(linea):
-            # Preferir el texto original (por si trae guion/k)
-            campos["rut"] = linea.strip()
+        # RUT con guión (aunque el DV sea incorrecto) o solo dígitos con DV correcto que no sean un celular
+        if normalizar_rut(campos["rut"]):
+            break
+        if es_rut_con_formato(linea):
+            campos["rut"] = normalizar_rut(linea) or linea
             sin_label.remove(linea)
+            break
+        if normalizar_rut(linea) and not parece_celular(linea):
+            campos["rut"] = normalizar_rut(linea)
+            sin_label.remove(linea)
+            break
 
     for linea in list(sin_label):
-        if not campos["telefono"] and es_telefono_plausible(linea):
+        if not campos["telefono"] and es_telefono_plausible(linea) and not es_rut_con_formato(linea):
             campos["telefono"] = limpiar_digitos(linea)
             sin_label.remove(linea)
 
@@ -639,9 +1046,12 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
             sin_label.remove(linea)
             break
 
-    data.update(campos)
+    return campos
+
 
-    # 4) Validación (tolerante): no bloquea por RUT sin guión o teléfono “corto”, pero sí exige correo válido.
+def validar_empresa_contacto(data: dict) -> list:
+    # Validación (tolerante): no bloquea por RUT sin guión o teléfono “corto”,
+    # pero sí exige correo válido y dígito verificador del RUT correcto.
     faltantes = []
 
     if not str(data.get("empresa", "")).strip():
@@ -649,6 +1059,8 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
 
     if not str(data.get("rut", "")).strip():
         faltantes.append("RUT")
+    elif not normalizar_rut(data.get("rut")):
+        faltantes.append(RUT_INVALIDO)
 
     if not str(data.get("contacto", "")).strip():
         faltantes.append("Nombre de contacto")
@@ -663,40 +1075,10 @@ def manejar_flujo_cotizacion_empresa_bloque(session: dict, message_text: str) ->
     if not tel_val:
         faltantes.append("Teléfono")
 
-    if faltantes:
-        session["state"] = "cotizacion_empresa_bloque"
-        return build_reply(
-            [
-                "No fue posible registrar la información, ya que faltan datos obligatorios o el correo presenta un formato inválido.",
-                "Campos a corregir:\n- " + "\n- ".join(faltantes),
-                (
-                    "Por favor, envíe únicamente los campos faltantes o corregidos. "
-                    "Ejemplo:\nCorreo: cliente@empresa.com\nTeléfono: 56912345678"
-                ),
-            ]
-        )
-
-    # Etapa 2: solicitar producto en bloque separado
-    session["state"] = "cotizacion_producto_bloque"
-    return build_reply(
-        [
-            "Gracias. A continuación, por favor envíe la información del producto.",
-            (
-                "En un SOLO mensaje, indique:\n"
-                "Número de parte, marca, descripción detallada y cantidad.\n\n"
-                "Ejemplo:\n"
-                "Número de parte: ABC123\n"
-                "Marca: Siemens\n"
-                "Descripción: ...\n"
-                "Cantidad: 5"
-            ),
-        ]
-    )
-# ===================== FIN CAMBIO SOLICITADO =====================
+    return faltantes
 
 
-def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
-    data = session["data"]
+def parsear_producto(data: dict, message_text: str) -> dict:
     texto = message_text or ""
     lineas = [l for l in texto.splitlines() if l.strip()]
 
@@ -729,7 +1111,7 @@ def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
             if "empresa" in etiqueta_norm or "razon social" in etiqueta_norm or "razon_social" in etiqueta_norm:
                 campos["empresa"] = valor_clean
             elif etiqueta_norm in ("rut", "r.u.t", "r u t"):
-                campos["rut"] = valor_clean
+                campos["rut"] = normalizar_rut(valor_clean) or valor_clean
             elif "contacto" in etiqueta_norm:
                 campos["contacto"] = valor_clean
             elif "correo" in etiqueta_norm or "email" in etiqueta_norm:
@@ -757,8 +1139,10 @@ def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
         if numeros:
             campos["cantidad"] = numeros[-1].replace(",", ".")
 
-    data.update(campos)
+    return campos
 
+
+def validar_producto(data: dict) -> list:
     obligatorios = ["empresa", "rut", "contacto", "correo", "telefono", "num_parte", "cantidad"]
     nombres_legibles = {
         "empresa": "Nombre de la empresa",
@@ -772,6 +1156,9 @@ def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
 
     faltantes = [nombres_legibles[c] for c in obligatorios if not str(data.get(c, "")).strip()]
 
+    if str(data.get("rut", "")).strip() and not normalizar_rut(data.get("rut")):
+        faltantes.append(RUT_INVALIDO)
+
     try:
         cantidad_val = float(str(data.get("cantidad", "")).replace(",", "."))
         if cantidad_val <= 0:
@@ -781,17 +1168,11 @@ def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
         if "Cantidad (valor numérico)" not in faltantes:
             faltantes.append("Cantidad (valor numérico)")
 
-    if faltantes:
-        session["state"] = "cotizacion_bloque"
-        return build_reply(
-            [
-                "No fue posible registrar su solicitud, ya que existen campos obligatorios faltantes o inválidos.",
-                "Campos a corregir:\n- " + "\n- ".join(faltantes),
-                "Por favor, envíe únicamente los datos faltantes o corregidos.",
-            ]
-        )
-
-    resumen = (
+    return faltantes
+
+
+def resumen_cotizacion(data: dict) -> str:
+    return (
         "Resumen de su solicitud de cotización:\n"
         f"Nombre de la empresa: {data.get('empresa','')}\n"
         f"RUT: {data.get('rut','')}\n"
@@ -804,23 +1185,26 @@ def manejar_flujo_cotizacion_bloque(session: dict, message_text: str) -> dict:
         f"Dirección de entrega: {data.get('direccion_entrega','')}"
     )
 
-    account_id = obtener_o_crear_account(data)
-    crear_deal_en_zoho(data, account_id=account_id)
 
-    session["state"] = "menu_principal"
-    session["data"] = {}
+def registrar_cotizacion(data: dict) -> None:
+    """Hook de cotización completa: Account (por RUT) + Deal + correo al owner, o nota si es repetida."""
+    capturar_cotizacion(data)
+    huella = huella_cotizacion(data)
+    deal_existente = cotizaciones_recientes.buscar(huella)
+    if deal_existente:
+        print(f"[registrar_cotizacion] Cotización repetida; se agrega nota al Deal {deal_existente}")
+        agregar_nota_a_deal(deal_existente, data)
+        return
 
-    return build_reply(
-        [
-            "Gracias. Hemos registrado su solicitud con el siguiente detalle:",
-            resumen,
-            "Un ejecutivo de Selec se pondrá en contacto con usted.",
-        ]
-    )
+    account_id = obtener_o_crear_account(data)
+    resp = crear_deal_en_zoho(data, account_id=account_id)
+
+    deal_id = id_registro_creado(resp)
+    if deal_id:
+        cotizaciones_recientes.registrar(huella, deal_id)
 
 
-def manejar_flujo_postventa_bloque(session: dict, message_text: str) -> dict:
-    data = session["data"]
+def parsear_postventa(data: dict, message_text: str) -> dict:
     texto = message_text or ""
     lineas = texto.splitlines()
 
@@ -847,30 +1231,35 @@ def manejar_flujo_postventa_bloque(session: dict, message_text: str) -> dict:
         if "nombre" in etiqueta_norm:
             campos["nombre"] = valor_clean
         elif etiqueta_norm in ("rut", "r.u.t", "r u t"):
-            campos["rut"] = valor_clean
+            campos["rut"] = normalizar_rut(valor_clean) or valor_clean
         elif "factura" in etiqueta_norm or "n° factura" in etiqueta_norm:
             campos["numero_factura"] = valor_clean
         elif "descripcion" in etiqueta_norm or "descripción" in etiqueta_norm or "problema" in etiqueta_norm:
             campos["detalle"] = valor_clean
 
-    data.update(campos)
+    return campos
 
+
+def validar_postventa(data: dict) -> list:
     obligatorios = ["nombre", "rut", "numero_factura"]
     nombres_legibles = {"nombre": "Nombre", "rut": "RUT", "numero_factura": "Número de factura"}
 
     faltantes = [nombres_legibles[c] for c in obligatorios if not str(data.get(c, "")).strip()]
 
-    if faltantes:
-        session["state"] = "postventa_bloque"
-        return build_reply(
-            [
-                "No fue posible registrar correctamente su solicitud de postventa, ya que faltan datos obligatorios.",
-                "Campos a corregir:\n- " + "\n- ".join(faltantes),
-                "Por favor, envíe únicamente los datos faltantes o corregidos (por ejemplo: Número de factura: 12345).",
-            ]
-        )
-
-    resumen = (
+    if str(data.get("rut", "")).strip() and not normalizar_rut(data.get("rut")):
+        faltantes.append(RUT_INVALIDO)
+
+    return faltantes
+
+
+def registrar_postventa(data: dict) -> None:
+    """Hook de postventa completa: lo captura en disco y encola el caso para el CRM (no bloquea la respuesta)."""
+    capturar_postventa(data)
+    cola_postventa.encolar(dict(data))
+
+
+def resumen_postventa(data: dict) -> str:
+    return (
         "Resumen de su solicitud de postventa:\n"
         f"Nombre: {data['nombre']}\n"
         f"RUT: {data['rut']}\n"
@@ -878,17 +1267,66 @@ def manejar_flujo_postventa_bloque(session: dict, message_text: str) -> dict:
         f"Descripción del problema: {data['detalle'] or '(sin detalle adicional)'}"
     )
 
-    session["state"] = "menu_principal"
 
-    return build_reply(
-        [
-            "Gracias. Hemos registrado su solicitud de postventa con el siguiente detalle:",
-            resumen,
-            "En unos momentos un operador de Selec revisará su caso.",
-        ]
-    )
+# ===================== MOTOR DE FLUJOS =====================
+
+REGISTRO_FLUJOS = {
+    "parsers": {
+        "empresa_contacto": parsear_empresa_contacto,
+        "producto": parsear_producto,
+        "postventa": parsear_postventa,
+    },
+    "validadores": {
+        "empresa_contacto": validar_empresa_contacto,
+        "producto": validar_producto,
+        "postventa": validar_postventa,
+    },
+    "resumenes": {
+        "cotizacion": resumen_cotizacion,
+        "postventa": resumen_postventa,
+    },
+    "hooks": {
+        "registrar_cotizacion": registrar_cotizacion,
+        "registrar_postventa": registrar_postventa,
+    },
+}
+
+motor_flujos = MotorFlujos(
+    os.environ.get("FLUJOS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "flujos.json")),
+    REGISTRO_FLUJOS,
+    normalizar=normalizar_texto,
+    intervalo_recarga=float(os.environ.get("FLUJOS_RECARGA_SEG", 2)),
+)
+
+
+def precalentar() -> None:
+    """
+    Trabajo de arranque que conviene hacer una sola vez, antes del fork de los workers
+    (gunicorn con preload_app): access token de Zoho y flujos compilados. Las sesiones
+    ya quedan restauradas al importar el módulo y los workers las heredan.
+    """
+    inicio = time.perf_counter()
+    token = get_access_token()
+    motor_flujos.recargar_si_cambio()
+    duracion_ms = (time.perf_counter() - inicio) * 1000
+    print(f"[precalentar] token Zoho {'ok' if token else 'no disponible'}, flujos v{motor_flujos.version}, "
+          f"{len(sessions)} sesiones, en {duracion_ms:.1f} ms")
+
+
+def recargar_sesiones_si_cambio() -> None:
+    """
+    Para un worker recién creado por fork (gunicorn con preload_app): las sesiones heredadas
+    son las que el master restauró al arrancar. Si desde entonces otro worker escribió en el
+    journal (p. ej. este worker reemplaza a uno que murió), se vuelven a leer del journal.
+    """
+    if not journal_sesiones.cambio_desde_restauracion():
+        return
+    restauradas = journal_sesiones.restaurar()
+    sessions.clear()
+    sessions.update(restauradas)
 
 
 if __name__ == "__main__":
+    # Solo desarrollo local; en producción se usa gunicorn (ver gunicorn.conf.py y Procfile)
     port = int(os.environ.get("PORT", 3000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=os.environ.get("FLASK_DEBUG", "1") == "1")
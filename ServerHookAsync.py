@@ -0,0 +1,196 @@
+"""
+Entrada ASGI (asyncio) del webhook de SalesIQ.
+
+Mismo comportamiento que ServerHook (mismas rutas, flujos, sesiones y journal),
+pero todas las llamadas a Zoho corren en el event loop sobre un cliente httpx con
+pool de conexiones: la cotización como tarea asyncio y los casos de postventa en
+lotes desde una cola asyncio (ColaLotesAsync). La respuesta a Zobot no espera al
+CRM y un solo proceso puede atender miles de conversaciones concurrentes.
+
+Ejecutar con:  uvicorn ServerHookAsync:app --host 0.0.0.0 --port $PORT
+"""
+import os
+import time
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+import ServerHook as hook
+from motor_flujos import MotorFlujos
+from cola_lotes import ColaLotesAsync
+from zoho_async import ClienteZohoAsync
+
+cliente_zoho = None
+tareas_crm = set()
+
+
+def _cliente() -> ClienteZohoAsync:
+    # Se crea dentro del event loop (lifespan o primer uso si el servidor no envía lifespan)
+    global cliente_zoho
+    if cliente_zoho is None:
+        cliente_zoho = ClienteZohoAsync(max_conexiones=int(os.environ.get("ZOHO_MAX_CONEXIONES", 100)))
+    return cliente_zoho
+
+
+def _programar(corrutina) -> None:
+    """Agenda trabajo de fondo sin bloquear la respuesta; el apagado espera a que termine."""
+    tarea = asyncio.get_running_loop().create_task(corrutina)
+    tareas_crm.add(tarea)
+    tarea.add_done_callback(_tarea_terminada)
+
+
+def _programar_cotizacion(data: dict) -> None:
+    """Hook registrar_cotizacion: agenda la escritura en Zoho sin bloquear la respuesta."""
+    _programar(_cliente().registrar_cotizacion(dict(data)))
+
+
+cola_postventa = ColaLotesAsync(
+    lambda lote: _cliente().insertar_cases_en_lote(lote),
+    nombre="cola-postventa-async",
+    tam_lote=hook.cola_postventa.tam_lote,
+    espera_max=hook.cola_postventa.espera_max,
+)
+
+
+async def _capturar_y_encolar_postventa(data: dict) -> None:
+    # La captura escribe en el log/archivo con un lock de hilos: fuera del event loop
+    await asyncio.to_thread(hook.capturar_postventa, data)
+    cola_postventa.encolar(data)
+
+
+def _encolar_postventa(data: dict) -> None:
+    """Hook registrar_postventa: captura y encola el caso para el lote async."""
+    _programar(_capturar_y_encolar_postventa(dict(data)))
+
+
+def _tarea_terminada(tarea: asyncio.Task) -> None:
+    tareas_crm.discard(tarea)
+    if not tarea.cancelled() and tarea.exception() is not None:
+        print("ERROR en tarea CRM async:", tarea.exception())
+
+
+REGISTRO_FLUJOS_ASYNC = dict(hook.REGISTRO_FLUJOS)
+REGISTRO_FLUJOS_ASYNC["hooks"] = dict(hook.REGISTRO_FLUJOS["hooks"], registrar_cotizacion=_programar_cotizacion,
+                                      registrar_postventa=_encolar_postventa)
+
+motor_flujos = MotorFlujos(
+    hook.motor_flujos.ruta,
+    REGISTRO_FLUJOS_ASYNC,
+    normalizar=hook.normalizar_texto,
+    intervalo_recarga=hook.motor_flujos.intervalo_recarga,
+)
+
+
+# ===================== ASGI =====================
+
+async def _leer_cuerpo(receive) -> bytes:
+    cuerpo = b""
+    while True:
+        mensaje = await receive()
+        cuerpo += mensaje.get("body", b"")
+        if not mensaje.get("more_body"):
+            return cuerpo
+
+
+async def _responder(send, status: int, cuerpo: bytes, content_type: bytes) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+async def _responder_json(send, obj, status: int = 200) -> None:
+    # Mismo formato que jsonify de Flask (claves ordenadas, ASCII escapado)
+    cuerpo = (json.dumps(obj, sort_keys=True, separators=(",", ":")) + "\n").encode()
+    await _responder(send, status, cuerpo, b"application/json")
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            _cliente()
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            # Apagado ordenado: terminar las escrituras al CRM en curso dentro de SERVIDOR_DRENAJE_SEG
+            limite = time.monotonic() + hook.SERVIDOR_DRENAJE_SEG
+            if tareas_crm:
+                print(f"[ServerHookAsync] Esperando {len(tareas_crm)} tareas CRM pendientes...")
+                await asyncio.wait(tareas_crm, timeout=hook.SERVIDOR_DRENAJE_SEG)
+            await cola_postventa.detener(timeout=max(limite - time.monotonic(), 0))
+            await _cliente().cerrar()
+            hook.journal_sesiones.cerrar()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+
+    if path == "/" and method == "GET":
+        await _responder(send, 200, b"Webhook server running", b"text/html; charset=utf-8")
+        return
+
+    if path == "/estado" and method == "GET":
+        token = dict(scope["headers"]).get(b"x-estado-token", b"").decode("latin-1") \
+            or (parse_qs(scope["query_string"].decode("latin-1")).get("token") or [""])[0]
+        if not hook.estado_autorizado(token):
+            await _responder(send, 404, b"Not Found", b"text/plain")
+            return
+        await _responder_json(send, dict(hook.estado_servidor(), tareas_crm=len(tareas_crm),
+                                         postventa_pendientes=cola_postventa.pendientes(),
+                                         postventa_descartados=cola_postventa.descartados))
+        return
+
+    if path != "/salesiq-webhook":
+        await _responder(send, 404, b"Not Found", b"text/plain")
+        return
+
+    if method == "GET":
+        await _responder_json(send, {"status": "ok", "message": "Use POST desde Zoho SalesIQ"})
+        return
+
+    if method != "POST":
+        await _responder(send, 405, b"Method Not Allowed", b"text/plain")
+        return
+
+    try:
+        payload = json.loads(await _leer_cuerpo(receive) or b"null") or {}
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+
+    visitor_id = hook.get_visitor_id(payload)
+
+    message_text = None
+    coalescencia = hook.preparar_coalescencia(payload, motor_flujos)
+    if coalescencia:
+        message_text = await hook.coalescedor.esperar_bloque_async(*coalescencia)
+        if message_text is None:
+            # El bloque lo procesa (y responde) el último mensaje de la ventana
+            await _responder_json(send, hook.build_reply([]))
+            return
+
+    # Purga de sesiones y recarga de flujos recorren memoria y disco: en un hilo, no en el loop
+    if hook.mantenimiento_pendiente(motor_flujos):
+        await asyncio.to_thread(hook.mantenimiento, motor_flujos)
+    respuesta = hook.procesar_payload(payload, motor=motor_flujos, message_text=message_text)
+    hook.journal_sesiones.registrar(visitor_id, hook.sessions.get(visitor_id))
+    await _responder_json(send, respuesta)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("ServerHookAsync:app", host="0.0.0.0", port=int(os.environ.get("PORT", 3000)))
@@ -0,0 +1,111 @@
+"""
+Benchmark de arranque: servidor de desarrollo vs. gunicorn (con y sin preload_app).
+
+Prepara un journal con N sesiones y un Zoho simulado (para el refresh del token) y
+mide, para cada modo, el tiempo desde el lanzamiento hasta que el servidor responde
+y todos los workers terminaron su calentamiento, además de cuántas veces se restauró
+el journal y cuántos tokens se pidieron a Zoho.
+
+Uso: python benchmarks/bench_arranque.py [sesiones]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from journal_sesiones import JournalSesiones
+from bench_async import puerto_libre, iniciar, esperar_listo
+from bench_journal import sesion_ejemplo
+
+
+def preparar_journal(ruta: str, n: int) -> None:
+    journal = JournalSesiones(ruta, umbral_compactacion=10 ** 9)
+    for i in range(n):
+        journal.registrar(f"visitor-{i}", sesion_ejemplo(i))
+    journal.cerrar()
+    journal.compactar()
+
+
+def tokens_pedidos(p_zoho: int) -> int:
+    return httpx.get(f"http://127.0.0.1:{p_zoho}/_stats").json().get("POST /oauth/v2/token", 0)
+
+
+def medir(nombre: str, args: list, env: dict, puerto: int, p_zoho: int, calentamientos: int) -> None:
+    tokens_antes = tokens_pedidos(p_zoho)
+    with tempfile.TemporaryFile("w+") as salida:
+        inicio = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=RAIZ, env=env, stdout=salida, stderr=subprocess.STDOUT)
+        try:
+            esperar_listo(f"http://127.0.0.1:{puerto}/", timeout=120)
+            primera = time.perf_counter() - inicio
+            # Listo = todos los workers pasaron por precalentar() (o sin precalentar en modo desarrollo)
+            while True:
+                salida.seek(0)
+                log = salida.read()
+                if log.count("[precalentar]") >= calentamientos:
+                    break
+                if time.perf_counter() - inicio > 120:
+                    raise RuntimeError(f"{nombre}: workers sin calentar a tiempo")
+                time.sleep(0.05)
+            listo = time.perf_counter() - inicio
+        finally:
+            proc.terminate()
+            proc.wait(30)
+
+    print(f"{nombre:34s} primera respuesta {primera:6.2f} s | listo {listo:6.2f} s | "
+          f"restauraciones {log.count('[journal_sesiones]'):2d} | tokens Zoho {tokens_pedidos(p_zoho) - tokens_antes:2d}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    directorio = tempfile.mkdtemp(prefix="bench_arranque_")
+    ruta_journal = os.path.join(directorio, "sesiones.db")
+    preparar_journal(ruta_journal, n)
+
+    p_zoho = puerto_libre()
+    env = dict(
+        os.environ,
+        PYTHONUNBUFFERED="1",
+        ZOHO_SIMULADO_LATENCIA_MS=os.environ.get("ZOHO_SIMULADO_LATENCIA_MS", "300"),
+        ZOHO_CLIENT_ID="bench", ZOHO_CLIENT_SECRET="bench", ZOHO_REFRESH_TOKEN="bench",
+        ZOHO_ACCOUNTS_BASE=f"http://127.0.0.1:{p_zoho}",
+        ZOHO_CRM_BASE=f"http://127.0.0.1:{p_zoho}/crm/v2.1",
+        SESSION_JOURNAL_PATH=ruta_journal,
+    )
+    gunicorn = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"]
+
+    zoho = iniciar([sys.executable, "benchmarks/zoho_simulado.py", str(p_zoho)], env)
+    try:
+        esperar_listo(f"http://127.0.0.1:{p_zoho}/_stats")
+        print(f"Journal con {n} sesiones\n")
+
+        puerto = puerto_libre()
+        medir("python ServerHook.py (debug)", [sys.executable, "ServerHook.py"],
+              dict(env, PORT=str(puerto), FLASK_DEBUG="1"), puerto, p_zoho, calentamientos=0)
+
+        modos = (
+            ("gunicorn hilos, sin preload", dict(SERVIDOR_MODO="hilos", SERVIDOR_PRECARGA="0"), 1),
+            ("gunicorn hilos, preload", dict(SERVIDOR_MODO="hilos", SERVIDOR_PRECARGA="1"), 1),
+            ("gunicorn asgi, preload", dict(SERVIDOR_MODO="asgi", SERVIDOR_PRECARGA="1"), 1),
+        )
+        for nombre, extra, calentamientos in modos:
+            puerto = puerto_libre()
+            medir(nombre, gunicorn, dict(env, PORT=str(puerto), **extra),
+                  puerto, p_zoho, calentamientos)
+    finally:
+        zoho.terminate()
+        zoho.wait(10)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
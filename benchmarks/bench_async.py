@@ -0,0 +1,130 @@
+"""
+Benchmark: entrada Flask (Werkzeug con hilos) vs. entrada ASGI (uvicorn + httpx).
+
+Levanta un Zoho simulado con latencia fija, cada servidor del webhook apuntando
+a él, y ejecuta N conversaciones de cotización completas en paralelo contra cada
+uno. Informa conversaciones/s y latencias del mensaje final (el que dispara las
+llamadas al CRM).
+
+Uso: python benchmarks/bench_async.py [conversaciones] [latencia_zoho_ms]
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+import statistics
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from rut import calcular_dv
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar(args, env) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def esperar_listo(url: str, timeout: float = 20.0) -> None:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} no respondió a tiempo")
+
+
+def mensajes_cotizacion(i: int) -> list:
+    cuerpo = str(76000000 + i)
+    rut = f"{cuerpo}-{calcular_dv(cuerpo)}"
+    return [
+        None,  # trigger
+        "Solicitud Cotización",
+        f"Empresa: Empresa {i} SpA\nRUT: {rut}\nContacto: Juan Pérez\nCorreo: c{i}@empresa.cl\nTeléfono: 56912345678",
+        f"Número de parte: PN-{i}\nMarca: Siemens\nCantidad: {i % 7 + 1}",
+    ]
+
+
+async def conversacion(cliente: httpx.AsyncClient, url: str, i: int, latencias_finales: list) -> None:
+    visitor = {"active_conversation_id": f"bench-{os.getpid()}-{i}-{time.time_ns()}"}
+    for texto in mensajes_cotizacion(i):
+        if texto is None:
+            payload = {"handler": "trigger", "visitor": visitor}
+        else:
+            payload = {"handler": "message", "visitor": visitor, "message": {"text": texto}}
+        inicio = time.perf_counter()
+        resp = await cliente.post(url, json=payload)
+        resp.raise_for_status()
+    latencias_finales.append(time.perf_counter() - inicio)
+
+
+async def correr(url: str, n: int) -> dict:
+    latencias = []
+    limites = httpx.Limits(max_connections=n, max_keepalive_connections=n)
+    async with httpx.AsyncClient(timeout=120, limits=limites) as cliente:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(conversacion(cliente, url, i, latencias) for i in range(n)))
+        total = time.perf_counter() - inicio
+    latencias.sort()
+    return {
+        "total_s": total,
+        "conv_por_s": n / total,
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latencia_ms = sys.argv[2] if len(sys.argv) > 2 else "150"
+
+    p_zoho, p_flask, p_asgi = puerto_libre(), puerto_libre(), puerto_libre()
+    env = dict(
+        os.environ,
+        ZOHO_SIMULADO_LATENCIA_MS=latencia_ms,
+        ZOHO_CLIENT_ID="bench", ZOHO_CLIENT_SECRET="bench", ZOHO_REFRESH_TOKEN="bench",
+        ZOHO_ACCOUNTS_BASE=f"http://127.0.0.1:{p_zoho}",
+        ZOHO_CRM_BASE=f"http://127.0.0.1:{p_zoho}/crm/v2.1",
+        SESSION_JOURNAL_PATH="",
+        COTIZACION_DEDUPE_SEG="0",
+        COTIZACIONES_CAPTURA_PATH="",
+        POSTVENTA_CAPTURA_PATH="",
+        MENSAJES_VENTANA_SEG="0",
+    )
+
+    procesos = [iniciar([sys.executable, "benchmarks/zoho_simulado.py", str(p_zoho)], env)]
+    try:
+        esperar_listo(f"http://127.0.0.1:{p_zoho}/_stats")
+        procesos.append(iniciar([sys.executable, "-c",
+                                 f"import ServerHook; ServerHook.app.run(host='127.0.0.1', port={p_flask}, threaded=True)"], env))
+        procesos.append(iniciar([sys.executable, "-m", "uvicorn", "ServerHookAsync:app",
+                                 "--host", "127.0.0.1", "--port", str(p_asgi), "--log-level", "warning"], env))
+        esperar_listo(f"http://127.0.0.1:{p_flask}/")
+        esperar_listo(f"http://127.0.0.1:{p_asgi}/")
+
+        print(f"{n} conversaciones concurrentes, latencia Zoho simulada {latencia_ms} ms\n")
+        for nombre, puerto in (("Flask (Werkzeug, hilos)", p_flask), ("ASGI (uvicorn + httpx)", p_asgi)):
+            r = asyncio.run(correr(f"http://127.0.0.1:{puerto}/salesiq-webhook", n))
+            print(f"{nombre:26s} total {r['total_s']:6.2f} s | {r['conv_por_s']:7.1f} conv/s | "
+                  f"mensaje final p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms")
+    finally:
+        for p in procesos:
+            p.terminate()
+        for p in procesos:
+            p.wait(10)
+
+
+if __name__ == "__main__":
+    main()
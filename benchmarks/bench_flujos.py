@@ -0,0 +1,64 @@
+"""
+Benchmark del motor de flujos: costo de despacho por mensaje.
+
+  - despacho puro: estado "transicion" (sin parseo) => lookup + construcción de respuesta
+  - formulario:    motor.procesar() vs. llamar parser + validador directamente;
+                   la diferencia es el overhead del motor.
+
+Uso: python benchmarks/bench_flujos.py [N]
+"""
+import io
+import os
+import sys
+import time
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import ServerHook
+
+MENSAJE_EMPRESA = "Empresa: ACME SpA\nRUT: 76.123.456-0\nContacto: Juan Pérez\nCorreo: juan@acme.cl"
+
+
+def medir(n: int, funcion) -> float:
+    inicio = time.perf_counter()
+    for _ in range(n):
+        funcion()
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    motor = ServerHook.motor_flujos
+
+    def despacho_transicion():
+        motor.procesar({"state": "inicio", "data": {}}, "message", "hola")
+
+    def despacho_formulario():
+        motor.procesar({"state": "cotizacion_empresa_bloque", "data": {}}, "message", MENSAJE_EMPRESA)
+
+    def directo_formulario():
+        data = {}
+        data.update(ServerHook.parsear_empresa_contacto(data, MENSAJE_EMPRESA))
+        ServerHook.validar_empresa_contacto(data)
+
+    def recarga_sin_cambios():
+        motor.recargar_si_cambio()
+
+    transicion_us = medir(n, despacho_transicion)
+    formulario_us = medir(n // 10, despacho_formulario)
+    directo_us = medir(n // 10, directo_formulario)
+    recarga_us = medir(n, recarga_sin_cambios)
+
+    print(f"mensajes:                            {n}")
+    print(f"despacho estado 'transicion':        {transicion_us:.2f} us/mensaje")
+    print(f"formulario vía motor:                {formulario_us:.2f} us/mensaje")
+    print(f"formulario directo (parser+valid.):  {directo_us:.2f} us/mensaje")
+    print(f"overhead del motor en formulario:    {formulario_us - directo_us:.2f} us/mensaje")
+    print(f"recargar_si_cambio() sin cambios:    {recarga_us:.2f} us/mensaje")
+
+
+if __name__ == "__main__":
+    main()
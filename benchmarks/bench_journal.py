@@ -0,0 +1,96 @@
+"""
+Benchmark del journal de sesiones:
+  - costo de registrar() en el camino del webhook
+  - tiempo de restauración en frío para N sesiones (por defecto 100k)
+  - duración de la compactación y cuánto frena a otro hilo mientras corre
+
+Uso: python benchmarks/bench_journal.py [N]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal_sesiones import JournalSesiones
+
+
+def sesion_ejemplo(i: int) -> dict:
+    return {
+        "state": "cotizacion_bloque",
+        "data": {
+            "empresa": f"Empresa {i} SpA",
+            "rut": "76123456-0",
+            "contacto": "Juan Pérez",
+            "correo": f"contacto{i}@empresa.cl",
+            "telefono": "56912345678",
+        },
+    }
+
+
+def max_pausa_hilo(funcion) -> tuple:
+    """Ejecuta `funcion` mientras otro hilo hace ticks de 1 ms; devuelve (duración, peor pausa) en ms."""
+    detener = threading.Event()
+    pausas = [0.0]
+
+    def ticker():
+        anterior = time.perf_counter()
+        while not detener.is_set():
+            time.sleep(0.001)
+            ahora = time.perf_counter()
+            pausas[0] = max(pausas[0], ahora - anterior - 0.001)
+            anterior = ahora
+
+    hilo = threading.Thread(target=ticker)
+    hilo.start()
+    inicio = time.perf_counter()
+    funcion()
+    duracion = time.perf_counter() - inicio
+    detener.set()
+    hilo.join()
+    return duracion * 1000, pausas[0] * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "sesiones.db")
+        journal = JournalSesiones(ruta, intervalo_flush=0.05, umbral_compactacion=10**9)
+
+        inicio = time.perf_counter()
+        for i in range(n):
+            journal.registrar(f"visitor-{i}", sesion_ejemplo(i))
+        registrar_us = (time.perf_counter() - inicio) / n * 1e6
+        journal.cerrar()
+
+        # Segunda vuelta: cada visitante queda con una fila vieja que compactar
+        journal = JournalSesiones(ruta, intervalo_flush=0.05, umbral_compactacion=10**9)
+        for i in range(n):
+            journal.registrar(f"visitor-{i}", sesion_ejemplo(i))
+        journal.cerrar()
+
+        # Reinicio sin compactar: la mitad de las filas están reemplazadas
+        inicio = time.perf_counter()
+        sesiones = JournalSesiones(ruta).restaurar()
+        sin_compactar_ms = (time.perf_counter() - inicio) * 1000
+        assert len(sesiones) == n
+
+        compactar_ms, pausa_ms = max_pausa_hilo(JournalSesiones(ruta).compactar)
+
+        inicio = time.perf_counter()
+        sesiones = JournalSesiones(ruta).restaurar()
+        compactado_ms = (time.perf_counter() - inicio) * 1000
+        assert len(sesiones) == n
+
+    print(f"sesiones:                     {n}")
+    print(f"registrar() por mensaje:      {registrar_us:.2f} us")
+    print(f"restaurar sin compactar:      {sin_compactar_ms:.0f} ms")
+    print(f"compactar:                    {compactar_ms:.0f} ms (peor pausa de otro hilo: {pausa_ms:.1f} ms)")
+    print(f"restaurar tras compactar:     {compactado_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Generador de carga: N visitantes concurrentes contra /salesiq-webhook.
+
+Cada visitante tiene su propio active_conversation_id y teléfono y recorre un guion
+realista de cotización o postventa; una fracción envía formularios mal formados
+(correo inválido, RUT con dígito verificador incorrecto, cantidad no numérica,
+falta el número de factura) y luego corrige, pasando por los ciclos de
+"Campos a corregir"; otra fracción envía los datos de la empresa como una ráfaga
+de mensajes sueltos, como en WhatsApp. La tasa de llegada de visitantes sube
+linealmente durante la prueba.
+
+Cada `--intervalo` segundos se imprime: visitantes activos, peticiones/s,
+latencias p50/p95/p99, tasa de error y, desde GET /estado, sesiones en memoria y
+RSS del proceso servidor. Al final, un resumen con el crecimiento de sesiones y RSS.
+/estado exige el ESTADO_TOKEN del servidor (--token-estado; con --lanzar se genera uno).
+
+Contra un servidor ya levantado:
+    python benchmarks/carga.py --url http://127.0.0.1:3000 --visitantes 2000
+Levantando un servidor local (gunicorn, SERVIDOR_MODO) con el Zoho simulado:
+    python benchmarks/carga.py --lanzar hilos --visitantes 2000 --tasa-final 200
+"""
+import os
+import sys
+import csv
+import time
+import random
+import asyncio
+import shutil
+import secrets
+import argparse
+import tempfile
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from rut import calcular_dv
+from bench_async import puerto_libre, iniciar, esperar_listo
+
+CORREGIR = "Campos a corregir"
+REGISTRADO = "Hemos registrado"
+
+
+# ===================== Guiones =====================
+#
+# Cada paso es (texto, esperado): texto None = evento trigger; una lista de textos =
+# ráfaga de mensajes enviados sin esperar respuesta; `esperado` es un fragmento que
+# debe aparecer en las respuestas (si no, cuenta como error de flujo).
+
+def rut_de(i: int, valido: bool = True) -> str:
+    cuerpo = str(76000000 + i % 20000000)
+    dv = calcular_dv(cuerpo)
+    if not valido:
+        dv = "0" if dv != "0" else "1"
+    return f"{cuerpo}-{dv}"
+
+
+def guion_cotizacion(i: int, telefono: str, malformado: bool, fragmentado: bool = False) -> list:
+    pasos = [(None, "Bienvenido"), ("Solicitud Cotización", "datos de la empresa")]
+    if fragmentado:
+        pasos += [
+            ([f"Nombre de la empresa: Empresa {i} SpA", f"RUT: {rut_de(i)}", "Nombre de contacto: Juan Pérez",
+              f"Correo: contacto{i}@empresa.cl", f"Teléfono: {telefono}"], "información del producto"),
+            (f"Número de parte: PN-{i}\nMarca: Siemens\nCantidad: {i % 9 + 1}", REGISTRADO),
+        ]
+    elif malformado:
+        pasos += [
+            (f"Nombre de la empresa: Empresa {i} SpA\nRUT: {rut_de(i, valido=False)}\n"
+             f"Nombre de contacto: Juan Pérez\nCorreo: contacto{i}-empresa.cl\nTeléfono: {telefono}", CORREGIR),
+            (f"RUT: {rut_de(i)}\nCorreo: contacto{i}@empresa.cl", "información del producto"),
+            (f"Número de parte: PN-{i}\nMarca: Siemens\nCantidad: varias", CORREGIR),
+            (f"Cantidad: {i % 9 + 1}", REGISTRADO),
+        ]
+    else:
+        pasos += [
+            (f"Nombre de la empresa: Empresa {i} SpA\nRUT: {rut_de(i)}\n"
+             f"Nombre de contacto: Juan Pérez\nCorreo: contacto{i}@empresa.cl\nTeléfono: {telefono}",
+             "información del producto"),
+            (f"Número de parte: PN-{i}\nMarca: Siemens\nDescripción: Variador de frecuencia\n"
+             f"Cantidad: {i % 9 + 1}", REGISTRADO),
+        ]
+    return pasos
+
+
+def guion_postventa(i: int, telefono: str, malformado: bool, fragmentado: bool = False) -> list:
+    pasos = [(None, "Bienvenido"), ("Servicio PostVenta", "solicitud de postventa")]
+    if fragmentado:
+        pasos += [
+            ([f"Nombre: Cliente {i}", f"RUT: {rut_de(i)}", f"Número de factura: {100000 + i}",
+              "Descripción del problema: No enciende"], REGISTRADO),
+        ]
+    elif malformado:
+        pasos += [
+            (f"Nombre: Cliente {i}\nRUT: {rut_de(i, valido=False)}\nDescripción del problema: No enciende", CORREGIR),
+            (f"RUT: {rut_de(i)}", CORREGIR),
+            (f"Número de factura: {100000 + i}", REGISTRADO),
+        ]
+    else:
+        pasos += [
+            (f"Nombre: Cliente {i}\nRUT: {rut_de(i)}\nNúmero de factura: {100000 + i}\n"
+             f"Descripción del problema: No enciende", REGISTRADO),
+        ]
+    return pasos
+
+
+# ===================== Métricas =====================
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class Metricas:
+    def __init__(self):
+        self.latencias = []        # todo el run
+        self.latencias_ventana = []
+        self.peticiones = 0
+        self.peticiones_ventana = 0
+        self.errores = {}          # tipo -> conteo
+        self.errores_ventana = 0
+        self.respuestas_vacias = 0  # mensajes absorbidos por la coalescencia del servidor
+        self.activos = 0
+        self.iniciados = 0
+        self.completados = 0
+
+    def registrar(self, latencia: float) -> None:
+        self.latencias.append(latencia)
+        self.latencias_ventana.append(latencia)
+        self.peticiones += 1
+        self.peticiones_ventana += 1
+
+    def error(self, tipo: str) -> None:
+        self.errores[tipo] = self.errores.get(tipo, 0) + 1
+        self.errores_ventana += 1
+
+    def cerrar_ventana(self):
+        ventana = (self.latencias_ventana, self.peticiones_ventana, self.errores_ventana)
+        self.latencias_ventana, self.peticiones_ventana, self.errores_ventana = [], 0, 0
+        return ventana
+
+
+# ===================== Visitantes =====================
+
+async def enviar(cliente: httpx.AsyncClient, url: str, payload: dict, metricas: Metricas):
+    """POST al webhook; devuelve la lista de textos respondidos o None si hubo error."""
+    inicio = time.perf_counter()
+    try:
+        resp = await cliente.post(url, json=payload)
+    except httpx.HTTPError as e:
+        metricas.error(type(e).__name__)
+        return None
+    metricas.registrar(time.perf_counter() - inicio)
+
+    if resp.status_code != 200:
+        metricas.error(f"HTTP {resp.status_code}")
+        return None
+    replies = resp.json().get("replies") or []
+    if not replies:
+        metricas.respuestas_vacias += 1
+    return replies
+
+
+async def rafaga(cliente: httpx.AsyncClient, url: str, payloads: list, separacion: float, metricas: Metricas):
+    """Envía los mensajes con `separacion` segundos entre sí sin esperar cada respuesta."""
+    async def enviar_en(k, payload):
+        await asyncio.sleep(k * separacion)
+        return await enviar(cliente, url, payload, metricas)
+
+    resultados = await asyncio.gather(*(enviar_en(k, p) for k, p in enumerate(payloads)))
+    if any(r is None for r in resultados):
+        return None
+    return [texto for replies in resultados for texto in replies]
+
+
+async def visitante(cliente: httpx.AsyncClient, url: str, i: int, args, metricas: Metricas) -> None:
+    rnd = random.Random(i)
+    telefono = f"569{10000000 + i % 90000000}"
+    visitor = {"active_conversation_id": f"carga-{args.prefijo}-{i}", "phone": telefono}
+    malformado = rnd.random() < args.malformados
+    fragmentado = not malformado and rnd.random() < args.fragmentados
+    guion = guion_postventa if rnd.random() < args.postventa else guion_cotizacion
+
+    metricas.activos += 1
+    metricas.iniciados += 1
+    try:
+        for texto, esperado in guion(i, telefono, malformado, fragmentado):
+            if texto is None:
+                replies = await enviar(cliente, url, {"handler": "trigger", "visitor": visitor}, metricas)
+            elif isinstance(texto, list):
+                payloads = [{"handler": "message", "visitor": visitor, "message": {"text": t}} for t in texto]
+                replies = await rafaga(cliente, url, payloads, args.separacion_rafaga, metricas)
+            else:
+                payload = {"handler": "message", "visitor": visitor, "message": {"text": texto}}
+                replies = await enviar(cliente, url, payload, metricas)
+
+            if replies is None:
+                return
+            if esperado not in "\n".join(replies):
+                # Respuesta inesperada: la sesión quedó en otro estado (p. ej. sesión perdida)
+                metricas.error("flujo")
+                return
+
+            await asyncio.sleep(rnd.uniform(0.5, 1.5) * args.pausa)
+        metricas.completados += 1
+    finally:
+        metricas.activos -= 1
+
+
+def tiempos_de_llegada(n: int, duracion: float, tasa_inicial: float, tasa_final: float) -> list:
+    """Instantes de inicio con tasa (visitantes/s) creciendo linealmente en `duracion` segundos."""
+    tiempos, t = [], 0.0
+    while len(tiempos) < n:
+        tasa = tasa_inicial + (tasa_final - tasa_inicial) * min(t / duracion, 1.0) if duracion > 0 else tasa_final
+        t += 1.0 / max(tasa, 0.001)
+        tiempos.append(t)
+    return tiempos
+
+
+async def muestrear_servidor(cliente: httpx.AsyncClient, url_estado: str) -> dict:
+    try:
+        resp = await cliente.get(url_estado)
+        if resp.status_code == 200:
+            return resp.json()
+    except httpx.HTTPError:
+        pass
+    return {}
+
+
+async def reportar(cliente, url_estado: str, args, metricas: Metricas, inicio: float, serie: list, fin: asyncio.Event):
+    print(f"{'t(s)':>6} {'activos':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'err %':>6} {'sesiones':>9} {'RSS MB':>8}")
+    while not fin.is_set():
+        try:
+            await asyncio.wait_for(fin.wait(), args.intervalo)
+        except asyncio.TimeoutError:
+            pass
+        latencias, peticiones, errores = metricas.cerrar_ventana()
+        estado = await muestrear_servidor(cliente, url_estado)
+        fila = {
+            "t": round(time.perf_counter() - inicio, 1),
+            "activos": metricas.activos,
+            "req_s": round(peticiones / args.intervalo, 1),
+            "p50_ms": round(percentil(latencias, 0.50) * 1000, 1),
+            "p95_ms": round(percentil(latencias, 0.95) * 1000, 1),
+            "p99_ms": round(percentil(latencias, 0.99) * 1000, 1),
+            "error_pct": round(100 * errores / max(peticiones + errores, 1), 2),
+            "sesiones": estado.get("sesiones", ""),
+            "rss_mb": round(estado["rss_kb"] / 1024, 1) if "rss_kb" in estado else "",
+        }
+        serie.append(fila)
+        print(f"{fila['t']:6.1f} {fila['activos']:8d} {fila['req_s']:8.1f} {fila['p50_ms']:8.1f} {fila['p95_ms']:8.1f} "
+              f"{fila['p99_ms']:8.1f} {fila['error_pct']:6.2f} {str(fila['sesiones']):>9} {str(fila['rss_mb']):>8}")
+
+
+async def correr(args, base: str) -> list:
+    url = f"{base}/salesiq-webhook"
+    metricas = Metricas()
+    serie = []
+    limites = httpx.Limits(max_connections=args.conexiones, max_keepalive_connections=args.conexiones)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limites) as cliente, \
+            httpx.AsyncClient(timeout=5, headers={"X-Estado-Token": args.token_estado or ""}) as cliente_estado:
+        estado_inicial = await muestrear_servidor(cliente_estado, f"{base}/estado")
+        inicio = time.perf_counter()
+        fin = asyncio.Event()
+        reportero = asyncio.create_task(reportar(cliente_estado, f"{base}/estado", args, metricas, inicio, serie, fin))
+
+        tareas = []
+        for i, t in enumerate(tiempos_de_llegada(args.visitantes, args.duracion, args.tasa_inicial, args.tasa_final)):
+            espera = t - (time.perf_counter() - inicio)
+            if espera > 0:
+                await asyncio.sleep(espera)
+            tareas.append(asyncio.create_task(visitante(cliente, url, i, args, metricas)))
+        await asyncio.gather(*tareas)
+
+        fin.set()
+        await reportero
+        estado_final = await muestrear_servidor(cliente_estado, f"{base}/estado")
+        total = time.perf_counter() - inicio
+
+    print("\n===== Resumen =====")
+    print(f"Visitantes: {metricas.iniciados} iniciados, {metricas.completados} completaron el guion en {total:.1f} s")
+    print(f"Peticiones: {metricas.peticiones} ({metricas.peticiones / total:.1f}/s) | "
+          f"p50 {percentil(metricas.latencias, 0.50) * 1000:.1f} ms  "
+          f"p95 {percentil(metricas.latencias, 0.95) * 1000:.1f} ms  "
+          f"p99 {percentil(metricas.latencias, 0.99) * 1000:.1f} ms  "
+          f"máx {max(metricas.latencias, default=0) * 1000:.1f} ms")
+    total_errores = sum(metricas.errores.values())
+    print(f"Errores: {total_errores} ({100 * total_errores / max(metricas.peticiones + total_errores, 1):.2f} %) "
+          f"{metricas.errores or ''}")
+    print(f"Respuestas sin textos (mensajes coalescidos por el servidor): {metricas.respuestas_vacias}")
+    if estado_final.get("coalescencia"):
+        print(f"Coalescencia en el servidor: {estado_final['coalescencia']}")
+    if estado_inicial and estado_final:
+        print(f"Sesiones en memoria: {estado_inicial['sesiones']} -> {estado_final['sesiones']} | "
+              f"RSS: {estado_inicial['rss_kb'] / 1024:.1f} -> {estado_final['rss_kb'] / 1024:.1f} MB "
+              f"(+{(estado_final['rss_kb'] - estado_inicial['rss_kb']) / max(metricas.iniciados, 1):.1f} KB por visitante)")
+    return serie
+
+
+def lanzar_servidor(modo: str, directorio: str, token_estado: str):
+    """Levanta Zoho simulado + gunicorn (SERVIDOR_MODO=modo) en puertos libres. Devuelve (base, procesos)."""
+    p_zoho, p_web = puerto_libre(), puerto_libre()
+    env = dict(
+        os.environ,
+        PORT=str(p_web),
+        SERVIDOR_MODO=modo,
+        ESTADO_TOKEN=token_estado,
+        ZOHO_CLIENT_ID="carga", ZOHO_CLIENT_SECRET="carga", ZOHO_REFRESH_TOKEN="carga",
+        ZOHO_ACCOUNTS_BASE=f"http://127.0.0.1:{p_zoho}",
+        ZOHO_CRM_BASE=f"http://127.0.0.1:{p_zoho}/crm/v2.1",
+        SESSION_JOURNAL_PATH=os.path.join(directorio, "sesiones.db"),
+        COTIZACIONES_CAPTURA_PATH=os.path.join(directorio, "cotizaciones.jsonl"),
+        POSTVENTA_CAPTURA_PATH=os.path.join(directorio, "postventa.jsonl"),
+    )
+    env.setdefault("ZOHO_SIMULADO_LATENCIA_MS", "150")
+    env.setdefault("SERVIDOR_PRECARGA", "1")
+    procesos = [iniciar([sys.executable, "benchmarks/zoho_simulado.py", str(p_zoho)], env)]
+    esperar_listo(f"http://127.0.0.1:{p_zoho}/_stats")
+    procesos.append(iniciar([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], env))
+    base = f"http://127.0.0.1:{p_web}"
+    esperar_listo(f"{base}/")
+    return base, procesos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /salesiq-webhook con visitantes concurrentes.")
+    parser.add_argument("--url", help="Base del servidor (p. ej. http://127.0.0.1:3000)")
+    parser.add_argument("--lanzar", choices=("hilos", "asgi"),
+                        help="Levantar gunicorn local en este modo con Zoho simulado (si no se da --url)")
+    parser.add_argument("--visitantes", type=int, default=500)
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de rampa de la tasa de llegada")
+    parser.add_argument("--tasa-inicial", type=float, default=5.0, help="Visitantes nuevos por segundo al inicio")
+    parser.add_argument("--tasa-final", type=float, default=50.0, help="Visitantes nuevos por segundo al final de la rampa")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Pausa media entre mensajes de un visitante (s)")
+    parser.add_argument("--postventa", type=float, default=0.3, help="Fracción de visitantes con guion de postventa")
+    parser.add_argument("--malformados", type=float, default=0.3, help="Fracción de visitantes con formularios mal formados")
+    parser.add_argument("--fragmentados", type=float, default=0.3,
+                        help="Fracción de visitantes que envían el formulario en varios mensajes sueltos")
+    parser.add_argument("--separacion-rafaga", type=float, default=0.3, help="Segundos entre mensajes de una ráfaga")
+    parser.add_argument("--conexiones", type=int, default=200, help="Conexiones HTTP máximas del generador")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--intervalo", type=float, default=2.0, help="Segundos entre filas del reporte")
+    parser.add_argument("--token-estado", default=os.environ.get("ESTADO_TOKEN"),
+                        help="ESTADO_TOKEN del servidor para leer /estado (por defecto, la variable de entorno)")
+    parser.add_argument("--csv", help="Guardar la serie temporal en este CSV")
+    parser.add_argument("--prefijo", default=str(int(time.time())), help="Prefijo de los IDs de conversación")
+    args = parser.parse_args()
+
+    if not args.url and not args.lanzar:
+        parser.error("indique --url o --lanzar")
+
+    procesos = []
+    directorio = None
+    try:
+        if args.url:
+            base = args.url.rstrip("/")
+        else:
+            # Journal y capturas del servidor local: datos de prueba que se borran al terminar
+            directorio = tempfile.mkdtemp(prefix="carga_")
+            args.token_estado = args.token_estado or secrets.token_hex(16)
+            base, procesos = lanzar_servidor(args.lanzar, directorio, args.token_estado)
+
+        serie = asyncio.run(correr(args, base))
+
+        if args.csv and serie:
+            with open(args.csv, "w", newline="", encoding="utf-8") as f:
+                escritor = csv.DictWriter(f, fieldnames=list(serie[0]))
+                escritor.writeheader()
+                escritor.writerows(serie)
+            print(f"Serie temporal guardada en {args.csv}")
+    finally:
+        for p in procesos:
+            p.terminate()
+        for p in procesos:
+            p.wait(30)
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
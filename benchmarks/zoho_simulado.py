@@ -0,0 +1,190 @@
+"""
+Zoho simulado (OAuth + CRM) para benchmarks y pruebas de carga locales.
+
+Responde como Zoho a las rutas que usa el webhook, con una latencia fija por
+llamada (ZOHO_SIMULADO_LATENCIA_MS, por defecto 150 ms). Los registros creados
+se guardan en memoria y las búsquedas (/<Modulo>/search) los filtran por las
+condiciones "equals" del criterio (unidas con OR), paginando con page/per_page;
+sin resultados devuelven 204, como Zoho.
+ZOHO_SIMULADO_FALLA_DEALS (0..1) hace fallar con 500 esa fracción de las
+inserciones de un solo Deal (las del webhook), para probar reconciliar.py.
+La Bulk Read API (/crm/bulk/v2.1/read) crea jobs que quedan completos de inmediato
+y entrega un zip con un CSV por página de ZOHO_SIMULADO_BULK_POR_PAGINA registros
+(por defecto 200000, como Zoho); el criterio admite equal / greater_equal y grupos "and".
+GET /_stats devuelve el conteo de llamadas por ruta.
+
+Uso:  python benchmarks/zoho_simulado.py [puerto]
+Y en el webhook:
+  ZOHO_ACCOUNTS_BASE=http://127.0.0.1:<puerto>
+  ZOHO_CRM_BASE=http://127.0.0.1:<puerto>/crm/v2.1
+"""
+import io
+import os
+import re
+import sys
+import csv
+import json
+import zipfile
+import random
+import asyncio
+import itertools
+from urllib.parse import parse_qs
+from datetime import datetime, timezone
+from collections import Counter, defaultdict
+
+LATENCIA = int(os.environ.get("ZOHO_SIMULADO_LATENCIA_MS", 150)) / 1000
+FALLA_DEALS = float(os.environ.get("ZOHO_SIMULADO_FALLA_DEALS", 0))
+BULK_POR_PAGINA = int(os.environ.get("ZOHO_SIMULADO_BULK_POR_PAGINA", 200000))
+
+ids = itertools.count(4358923000090000001)
+llamadas = Counter()
+registros = defaultdict(list)  # modulo -> registros creados
+jobs_bulk = {}  # job_id -> query
+
+
+async def _leer_cuerpo(receive) -> bytes:
+    cuerpo = b""
+    while True:
+        mensaje = await receive()
+        cuerpo += mensaje.get("body", b"")
+        if not mensaje.get("more_body"):
+            return cuerpo
+
+
+async def _responder(send, status: int, obj=None, cuerpo: bytes = None, tipo: bytes = b"application/json") -> None:
+    if cuerpo is None:
+        cuerpo = json.dumps(obj).encode() if obj is not None else b""
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", tipo)]})
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+def _clave(method: str, path: str) -> str:
+    partes = path.split("/")
+    # /crm/v2.1/Deals/<id>/Notes => /crm/v2.1/Deals/{id}/Notes
+    return method + " " + "/".join("{id}" if p.isdigit() else p for p in partes)
+
+
+async def _responder_busqueda(send, modulo: str, params: dict) -> None:
+    condiciones = re.findall(r"\((\w+):equals:([^()]*)\)", (params.get("criteria") or [""])[0])
+    encontrados = [r for r in registros[modulo]
+                   if any(str(r.get(campo)) == valor for campo, valor in condiciones)]
+    pagina = int((params.get("page") or ["1"])[0])
+    por_pagina = int((params.get("per_page") or ["200"])[0])
+    datos = encontrados[(pagina - 1) * por_pagina:pagina * por_pagina]
+    if not datos:
+        await _responder(send, 204)
+        return
+    await _responder(send, 200, {"data": datos, "info": {
+        "page": pagina, "per_page": por_pagina, "count": len(datos),
+        "more_records": pagina * por_pagina < len(encontrados),
+    }})
+
+
+def _cumple(registro: dict, criterio: dict) -> bool:
+    if "group" in criterio:
+        return all(_cumple(registro, c) for c in criterio["group"])
+    valor = str(registro.get(criterio["api_name"], ""))
+    if criterio["comparator"] == "greater_equal":
+        return valor >= str(criterio["value"])
+    return valor == str(criterio["value"])
+
+
+def _pagina_bulk(job_id: str):
+    """(filas de la página del job, hay_mas)."""
+    query = jobs_bulk[job_id]
+    modulo = query["module"]["api_name"] if isinstance(query["module"], dict) else query["module"]
+    encontrados = [r for r in registros[modulo] if _cumple(r, query.get("criteria") or {"group": []})]
+    pagina = int(query.get("page", 1))
+    filas = encontrados[(pagina - 1) * BULK_POR_PAGINA:pagina * BULK_POR_PAGINA]
+    return query, filas, pagina * BULK_POR_PAGINA < len(encontrados)
+
+
+async def _responder_bulk(send, method: str, partes: list, cuerpo: bytes) -> None:
+    # /crm/bulk/v2.1/read[/<job_id>[/result]]
+    if method == "POST":
+        job_id = str(next(ids))
+        jobs_bulk[job_id] = json.loads(cuerpo)["query"]
+        await _responder(send, 201, {"data": [{"status": "success", "code": "ADDED_SUCCESSFULLY",
+                                               "details": {"id": job_id, "operation": "read", "state": "ADDED"}}]})
+        return
+
+    job_id = partes[5]
+    if job_id not in jobs_bulk:
+        await _responder(send, 404, {"code": "INVALID_URL_PATTERN", "status": "error"})
+        return
+    query, filas, hay_mas = _pagina_bulk(job_id)
+
+    if len(partes) > 6:
+        campos = ["Id"] + [c for c in query.get("fields") or [] if c != "Id"]
+        texto = io.StringIO()
+        escritor = csv.DictWriter(texto, fieldnames=campos, extrasaction="ignore")
+        escritor.writeheader()
+        for fila in filas:
+            escritor.writerow(dict(fila, Id=fila["id"]))
+        zip_bytes = io.BytesIO()
+        with zipfile.ZipFile(zip_bytes, "w") as archivo:
+            archivo.writestr(f"{job_id}.csv", texto.getvalue())
+        await _responder(send, 200, cuerpo=zip_bytes.getvalue(), tipo=b"application/zip")
+        return
+
+    await _responder(send, 200, {"data": [{"id": job_id, "operation": "read", "state": "COMPLETED", "result": {
+        "page": int(query.get("page", 1)), "per_page": BULK_POR_PAGINA, "count": len(filas),
+        "download_url": f"/crm/bulk/v2.1/read/{job_id}/result", "more_records": hay_mas,
+    }}]})
+
+
+async def app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    cuerpo = await _leer_cuerpo(receive)
+
+    if path == "/_stats":
+        await _responder(send, 200, dict(llamadas))
+        return
+
+    llamadas[_clave(method, path)] += 1
+    await asyncio.sleep(LATENCIA)
+
+    if path == "/oauth/v2/token":
+        await _responder(send, 200, {"access_token": "token-simulado", "expires_in": 3600})
+        return
+
+    partes = path.split("/")
+    if path.startswith("/crm/bulk/"):
+        await _responder_bulk(send, method, partes, cuerpo)
+        return
+
+    # /crm/v2.1/<Modulo>[/...]
+    modulo = partes[3] if len(partes) > 3 else path
+
+    if method == "GET" and path.endswith("/search"):
+        await _responder_busqueda(send, modulo, parse_qs(scope["query_string"].decode()))
+        return
+
+    if method == "GET":
+        await _responder(send, 200, {"data": [], "info": {"more_records": False}})
+        return
+
+    nuevos = json.loads(cuerpo or b"{}").get("data") or [{}]
+    es_insercion = len(partes) == 4
+    if es_insercion and modulo == "Deals" and len(nuevos) == 1 and random.random() < FALLA_DEALS:
+        await _responder(send, 500, {"code": "INTERNAL_ERROR", "status": "error"})
+        return
+
+    resultados = []
+    creado = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    for registro in nuevos:
+        registro_id = str(next(ids))
+        if es_insercion:
+            registros[modulo].append(dict(registro, id=registro_id, Created_Time=creado))
+        resultados.append({"code": "SUCCESS", "status": "success", "details": {"id": registro_id}})
+    await _responder(send, 201, {"data": resultados})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8900
+    uvicorn.run(app, host="127.0.0.1", port=puerto, log_level="warning")
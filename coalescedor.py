@@ -0,0 +1,105 @@
+import time
+import asyncio
+import itertools
+import threading
+
+
+class CoalescedorMensajes:
+    """
+    Debounce por visitante: junta los mensajes que llegan con menos de `ventana_seg`
+    entre sí y los entrega como un solo bloque de texto (unidos por saltos de línea).
+    - Cada mensaje espera `ventana_seg`; si en ese lapso llegó otro del mismo visitante,
+      su request termina sin procesar (None) y el bloque lo procesa el último.
+    - Un visitante que no deja de escribir no espera indefinidamente: pasado
+      `espera_max_seg` desde el primer mensaje, el bloque se procesa igual.
+    - Con esperar=False el bloque se entrega en el acto (p. ej. el mensaje ya completa el
+      formulario): junto con lo pendiente del visitante, si lo hay.
+    - ventana_seg = 0 deshabilita la coalescencia (cada mensaje se procesa solo).
+    """
+
+    def __init__(self, ventana_seg: float = 1.5, espera_max_seg: float = 6.0):
+        self.ventana_seg = ventana_seg
+        self.espera_max_seg = espera_max_seg
+
+        self._lock = threading.Lock()
+        self._tickets = itertools.count(1)
+        self._pendientes = {}  # visitor_id -> {"textos", "tickets", "desde"}
+
+        self.mensajes = 0          # mensajes que pasaron por el coalescedor
+        self.bloques = 0           # bloques entregados al handler
+        self.bloques_multiples = 0  # bloques formados por más de un mensaje
+        # Mensajes que terminaron dentro del bloque de otro: cada uno es una invocación
+        # de handler y una respuesta ("Campos a corregir", etc.) menos.
+        self.absorbidos = 0
+
+    @property
+    def habilitado(self) -> bool:
+        return self.ventana_seg > 0
+
+    def agregar(self, visitor_id: str, texto: str) -> int:
+        """Suma el mensaje al bloque pendiente del visitante. Devuelve el ticket del mensaje."""
+        with self._lock:
+            ticket = next(self._tickets)
+            pendiente = self._pendientes.get(visitor_id)
+            if pendiente is None:
+                pendiente = self._pendientes[visitor_id] = {"textos": [], "tickets": [], "desde": time.monotonic()}
+            pendiente["textos"].append(texto)
+            pendiente["tickets"].append(ticket)
+            self.mensajes += 1
+        return ticket
+
+    def con_pendiente(self, visitor_id: str, texto: str) -> str:
+        """El texto que formaría el bloque si `texto` llegara ahora."""
+        with self._lock:
+            pendiente = self._pendientes.get(visitor_id)
+            textos = list(pendiente["textos"]) if pendiente else []
+        return "\n".join(t for t in textos + [texto] if t)
+
+    def tomar(self, visitor_id: str, ticket: int):
+        """
+        Tras la ventana: el texto del bloque si a este mensaje le toca procesarlo, o None si
+        lo procesa (o ya lo procesó) otro mensaje del mismo bloque.
+        """
+        with self._lock:
+            pendiente = self._pendientes.get(visitor_id)
+            if pendiente is None or ticket not in pendiente["tickets"]:
+                self.absorbidos += 1
+                return None
+            ultimo = pendiente["tickets"][-1] == ticket
+            vencido = time.monotonic() - pendiente["desde"] >= self.espera_max_seg
+            if not (ultimo or vencido):
+                self.absorbidos += 1
+                return None
+
+            del self._pendientes[visitor_id]
+            self.bloques += 1
+            if len(pendiente["textos"]) > 1:
+                self.bloques_multiples += 1
+        return "\n".join(t for t in pendiente["textos"] if t)
+
+    def esperar_bloque(self, visitor_id: str, texto: str, esperar: bool = True):
+        """Versión bloqueante (servidor con hilos)."""
+        if not self.habilitado:
+            return texto
+        ticket = self.agregar(visitor_id, texto)
+        if esperar:
+            time.sleep(self.ventana_seg)
+        return self.tomar(visitor_id, ticket)
+
+    async def esperar_bloque_async(self, visitor_id: str, texto: str, esperar: bool = True):
+        """Versión asyncio (entrada ASGI): la espera no ocupa un hilo."""
+        if not self.habilitado:
+            return texto
+        ticket = self.agregar(visitor_id, texto)
+        if esperar:
+            await asyncio.sleep(self.ventana_seg)
+        return self.tomar(visitor_id, ticket)
+
+    def metricas(self) -> dict:
+        return {
+            "ventana_seg": self.ventana_seg,
+            "mensajes": self.mensajes,
+            "bloques": self.bloques,
+            "bloques_multiples": self.bloques_multiples,
+            "handlers_y_respuestas_ahorrados": self.absorbidos,
+        }
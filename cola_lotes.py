@@ -0,0 +1,180 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+
+
+class ColaLotes:
+    """
+    Cola en memoria con un hilo de fondo que entrega los elementos en lotes.
+    - encolar() nunca bloquea al webhook (si la cola está llena, se descarta y se informa).
+    - Un lote se despacha al juntar `tam_lote` elementos o tras `espera_max` segundos
+      desde el primero, lo que ocurra antes.
+    - procesar_lote(lista) corre en el hilo de fondo; sus excepciones se registran y no
+      detienen la cola.
+    """
+
+    def __init__(self, procesar_lote, nombre: str = "cola-lotes", tam_lote: int = 100,
+                 espera_max: float = 1.0, max_pendientes: int = 10000):
+        self.procesar_lote = procesar_lote
+        self.nombre = nombre
+        self.tam_lote = tam_lote
+        self.espera_max = espera_max
+
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self._detener = threading.Event()
+
+        self.encolados = 0
+        self.descartados = 0
+        self.lotes_procesados = 0
+
+    def encolar(self, item) -> bool:
+        try:
+            self._cola.put_nowait(item)
+        except queue.Full:
+            self.descartados += 1
+            print(f"ERROR [{self.nombre}] cola llena ({self._cola.maxsize}); se descarta el elemento.")
+            return False
+        self.encolados += 1
+        self._asegurar_hilo()
+        return True
+
+    def pendientes(self) -> int:
+        return self._cola.qsize()
+
+    def _asegurar_hilo(self) -> None:
+        # Tras un fork (workers pre-fork) el hilo del padre no existe en el hijo.
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+            self._hilo.start()
+
+    def _tomar_lote(self) -> list:
+        try:
+            lote = [self._cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        limite = time.monotonic() + self.espera_max
+        while len(lote) < self.tam_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0 or self._detener.is_set():
+                # Al detener se vacía lo que ya está en cola sin esperar
+                try:
+                    lote.append(self._cola.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self) -> None:
+        while not (self._detener.is_set() and self._cola.empty()):
+            lote = self._tomar_lote()
+            if not lote:
+                continue
+            try:
+                self.procesar_lote(lote)
+            except Exception as e:
+                print(f"ERROR [{self.nombre}] procesando lote de {len(lote)}:", e)
+            self.lotes_procesados += 1
+
+    def detener(self, timeout: float = 30.0) -> None:
+        """Drena lo pendiente y detiene el hilo (apagado ordenado)."""
+        if self._hilo is None or self._pid != os.getpid():
+            return
+        self._detener.set()
+        self._hilo.join(timeout)
+        if self._hilo.is_alive():
+            print(f"[{self.nombre}] apagado con {self.pendientes()} elementos aún pendientes.")
+
+
+class ColaLotesAsync:
+    """
+    Equivalente de ColaLotes para la entrada ASGI: una tarea asyncio (en vez de un hilo)
+    junta los elementos y entrega cada lote a la corrutina procesar_lote(lista).
+    encolar() se llama desde el event loop y nunca bloquea.
+    """
+
+    def __init__(self, procesar_lote, nombre: str = "cola-lotes-async", tam_lote: int = 100,
+                 espera_max: float = 1.0, max_pendientes: int = 10000):
+        self.procesar_lote = procesar_lote
+        self.nombre = nombre
+        self.tam_lote = tam_lote
+        self.espera_max = espera_max
+        self.max_pendientes = max_pendientes
+
+        self._cola = None
+        self._tarea = None
+        self._procesando = False
+        self._deteniendo = False
+
+        self.encolados = 0
+        self.descartados = 0
+        self.lotes_procesados = 0
+
+    def encolar(self, item) -> bool:
+        self._asegurar_tarea()
+        try:
+            self._cola.put_nowait(item)
+        except asyncio.QueueFull:
+            self.descartados += 1
+            print(f"ERROR [{self.nombre}] cola llena ({self.max_pendientes}); se descarta el elemento.")
+            return False
+        self.encolados += 1
+        return True
+
+    def pendientes(self) -> int:
+        return self._cola.qsize() if self._cola is not None else 0
+
+    def _asegurar_tarea(self) -> None:
+        # La cola y la tarea se crean dentro del event loop que las usa
+        if self._cola is None:
+            self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+
+    async def _bucle(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self._cola.get()]
+            self._procesando = True
+            limite = loop.time() + self.espera_max
+            while True:
+                while len(lote) < self.tam_lote and not self._cola.empty():
+                    lote.append(self._cola.get_nowait())
+                # Al detener se despacha lo que ya está en cola sin esperar
+                if len(lote) >= self.tam_lote or self._deteniendo or loop.time() >= limite:
+                    break
+                await asyncio.sleep(min(0.05, limite - loop.time()))
+            try:
+                await self.procesar_lote(lote)
+            except Exception as e:
+                print(f"ERROR [{self.nombre}] procesando lote de {len(lote)}:", e)
+            self.lotes_procesados += 1
+            self._procesando = False
+
+    async def detener(self, timeout: float = 30.0) -> None:
+        """Drena lo pendiente y detiene la tarea (apagado ordenado)."""
+        if self._tarea is None:
+            return
+        self._deteniendo = True
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + timeout
+        while (self.pendientes() or self._procesando) and loop.time() < limite:
+            await asyncio.sleep(0.05)
+        if self.pendientes() or self._procesando:
+            print(f"[{self.nombre}] apagado con {self.pendientes()} elementos aún pendientes.")
+        self._tarea.cancel()
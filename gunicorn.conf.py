@@ -0,0 +1,107 @@
+"""
+Configuración de producción (gunicorn) del webhook de SalesIQ.
+
+    gunicorn -c gunicorn.conf.py
+
+Modos (SERVIDOR_MODO):
+  - "hilos" (por defecto): un proceso con worker gthread y varios hilos.
+  - "asgi": ServerHookAsync sobre un worker de uvicorn.
+
+Siempre hay un solo worker: las sesiones, el índice de cotizaciones y las colas viven
+en memoria de ese proceso, y el router de Heroku no tiene sesiones pegajosas (con
+varios workers cada mensaje de una conversación podría caer en un proceso distinto).
+
+Con SERVIDOR_PRECARGA=1 (por defecto) la app se importa en el master antes del fork:
+restauración del journal, token de Zoho y flujos se hacen una sola vez. Si gunicorn
+re-crea el worker (caída, timeout, max_requests), el nuevo vuelve a leer las sesiones
+del journal en vez de quedarse con las del arranque.
+
+Apagado: Heroku manda SIGTERM y mata el proceso 30 s después. El worker termina las
+peticiones en curso (SERVIDOR_GRACIA_SEG, 20 s por defecto) y luego drena la cola de
+postventa, las tareas CRM pendientes y el journal (SERVIDOR_DRENAJE_SEG, 8 s). El master
+espera la suma antes de matar al worker, así que la suma tiene que quedar bajo los 30 s.
+
+SESSION_JOURNAL_PATH es obligatoria: ruta del journal en almacenamiento que sobreviva al
+reinicio (volumen montado), o "" para correr sin journal. En el disco efímero de un dyno
+solo protege las sesiones frente a la re-creación del worker, no frente a restarts/deploys.
+"""
+import gc
+import os
+
+MODO = os.environ.get("SERVIDOR_MODO", "hilos")
+if MODO not in ("hilos", "asgi"):
+    raise ValueError(f"SERVIDOR_MODO desconocido: {MODO!r} (use hilos o asgi)")
+
+try:
+    NUCLEOS = len(os.sched_getaffinity(0))
+except AttributeError:
+    NUCLEOS = os.cpu_count() or 1
+
+# Los mensajes retenidos en la ventana de coalescencia (ServerHook.coalescedor) ocupan
+# un hilo que solo duerme; se reservan hilos extra para que no agoten el pool.
+HILOS_COALESCENCIA = 64 if float(os.environ.get("MENSAJES_VENTANA_SEG", 1.5)) > 0 else 0
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+workers = 1
+
+if MODO == "hilos":
+    wsgi_app = "ServerHook:app"
+    worker_class = "gthread"
+    # Las peticiones pasan la mayor parte del tiempo esperando a Zoho (I/O)
+    threads = int(os.environ.get("SERVIDOR_HILOS", max(8, 4 * NUCLEOS) + HILOS_COALESCENCIA))
+else:
+    wsgi_app = "ServerHookAsync:app"
+    worker_class = "uvicorn_worker.UvicornWorker"
+
+preload_app = os.environ.get("SERVIDOR_PRECARGA", "1") == "1"
+timeout = int(os.environ.get("SERVIDOR_TIMEOUT_SEG", 60))
+GRACIA_SEG = int(os.environ.get("SERVIDOR_GRACIA_SEG", 20))
+DRENAJE_SEG = int(os.environ.get("SERVIDOR_DRENAJE_SEG", 8))
+# Plazo del master para el apagado completo del worker; el worker usa solo GRACIA_SEG (post_fork)
+graceful_timeout = GRACIA_SEG + DRENAJE_SEG
+keepalive = 5
+accesslog = "-"
+
+
+def _precalentar() -> None:
+    import ServerHook
+
+    ServerHook.precalentar()
+
+
+def when_ready(server):
+    # Corre en el master, antes de crear los workers
+    if preload_app:
+        _precalentar()
+        # Lo cargado hasta aquí (sesiones restauradas, módulos) no lo recorre el GC de los
+        # workers, así sus páginas siguen compartidas tras el fork (copy-on-write).
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # La config del worker es su propia copia tras el fork: las peticiones en curso tienen
+    # GRACIA_SEG y lo que resta del plazo del master queda para el drenaje (worker_exit / lifespan).
+    worker.cfg.set("graceful_timeout", GRACIA_SEG)
+    if hasattr(worker, "config"):
+        # UvicornWorker arma su Config en el master; el plazo de uvicorn va aparte
+        worker.config.timeout_graceful_shutdown = GRACIA_SEG
+
+    # El worker hereda las sesiones restauradas por el master al arrancar; si es un
+    # reemplazo, el journal ya tiene lo que escribió el worker anterior.
+    if preload_app:
+        import ServerHook
+
+        ServerHook.recargar_sesiones_si_cambio()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        _precalentar()
+
+
+def worker_exit(server, worker):
+    # Peticiones en curso ya terminadas (GRACIA_SEG); vaciar lo que quedó en segundo plano
+    import ServerHook
+
+    ServerHook.journal_sesiones.cerrar(timeout=2)
+    ServerHook.cola_postventa.detener(timeout=max(DRENAJE_SEG - 2, 1))
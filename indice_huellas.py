@@ -0,0 +1,46 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class IndiceHuellas:
+    """
+    Índice acotado {huella: valor} con ventana de tiempo.
+    - Las entradas expiran `ventana_seg` segundos después de registrarse.
+    - Nunca guarda más de `max_entradas` (se descartan las más antiguas).
+    - ventana_seg = 0 deshabilita el índice (buscar siempre devuelve None).
+    """
+
+    def __init__(self, ventana_seg: float = 900, max_entradas: int = 10000):
+        self.ventana_seg = ventana_seg
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # huella -> (registrado_en, valor), en orden de registro
+        self._lock = threading.Lock()
+
+    def _purgar(self, ahora: float) -> None:
+        while self._entradas:
+            huella, (registrado_en, _) = next(iter(self._entradas.items()))
+            if ahora - registrado_en < self.ventana_seg and len(self._entradas) <= self.max_entradas:
+                break
+            self._entradas.popitem(last=False)
+
+    def buscar(self, huella: str):
+        if not self.ventana_seg:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            entrada = self._entradas.get(huella)
+            return entrada[1] if entrada else None
+
+    def registrar(self, huella: str, valor) -> None:
+        if not self.ventana_seg:
+            return
+        ahora = time.monotonic()
+        with self._lock:
+            self._entradas.pop(huella, None)
+            self._entradas[huella] = (ahora, valor)
+            self._purgar(ahora)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
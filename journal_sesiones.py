@@ -0,0 +1,217 @@
+import gc
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+
+# ===================== JOURNAL DE SESIONES (SQLite) =====================
+#
+# Cada cambio de sesión se agrega a la tabla `journal` (append-only) junto con su
+# vencimiento (`expira`, epoch; lo calcula `vencimiento(session)` del llamador).
+# Periódicamente se compacta con un solo DELETE dentro de SQLite: se borran las filas
+# reemplazadas por una más nueva del mismo visitante, las sesiones eliminadas y las
+# vencidas. No se deserializa nada en Python, así que la compactación no compite por
+# el GIL con los hilos que atienden mensajes (sqlite3 lo suelta mientras ejecuta).
+# Al arrancar se lee solo la última fila vigente de cada visitante.
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    visitor_id TEXT NOT NULL,
+    session    BLOB,
+    expira     REAL
+);
+CREATE INDEX IF NOT EXISTS journal_visitante ON journal (visitor_id, seq);
+"""
+
+# Última fila de cada visitante (el índice (visitor_id, seq) resuelve el GROUP BY)
+ULTIMAS_FILAS = "SELECT MAX(seq) FROM journal GROUP BY visitor_id"
+
+
+class JournalSesiones:
+    """
+    Persistencia de sesiones resistente a reinicios.
+    - registrar() no toca disco: deja la sesión serializada en un buffer en memoria.
+    - Un hilo de fondo escribe el buffer en lotes (una transacción por flush).
+    - Si `ruta` es vacía/None, el journal queda deshabilitado (no-op).
+    - `vencimiento(session)` devuelve el epoch a partir del cual la sesión ya no se
+      restaura y se borra al compactar (None = no vence).
+    """
+
+    def __init__(self, ruta, intervalo_flush: float = 0.2, umbral_compactacion: int = 50000, vencimiento=None):
+        self.ruta = ruta or None
+        self.intervalo_flush = intervalo_flush
+        self.umbral_compactacion = umbral_compactacion
+        self.vencimiento = vencimiento
+
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._filas_desde_compactacion = 0
+        self._seq_restaurado = 0
+        self._hilo = None
+        self._pid = None
+        self._detener = threading.Event()
+
+    @property
+    def habilitado(self) -> bool:
+        return self.ruta is not None
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.executescript(ESQUEMA)
+        return conn
+
+    @staticmethod
+    def _ultimo_seq(conn: sqlite3.Connection) -> int:
+        # sqlite_sequence no retrocede aunque la compactación borre las filas más nuevas
+        fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return fila[0] if fila else 0
+
+    # ---------- Arranque ----------
+
+    def restaurar(self) -> dict:
+        """Reconstruye {visitor_id: session} al arrancar el proceso."""
+        if not self.habilitado:
+            return {}
+
+        inicio = time.perf_counter()
+        conn = self._conectar()
+        # Sin GC durante la carga: son cientos de miles de dicts pequeños sin ciclos
+        gc.disable()
+        try:
+            filas_journal = conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+            cursor = conn.execute(
+                f"SELECT visitor_id, session FROM journal WHERE seq IN ({ULTIMAS_FILAS}) "
+                "AND session IS NOT NULL AND (expira IS NULL OR expira >= ?)",
+                (time.time(),),
+            )
+            sesiones = {visitor_id: pickle.loads(session) for visitor_id, session in cursor}
+            seq = self._ultimo_seq(conn)
+        finally:
+            gc.enable()
+            conn.close()
+
+        # Lo que sobra en el journal lo borra el hilo de escritura al compactar (fuera del arranque)
+        self._filas_desde_compactacion = filas_journal - len(sesiones)
+        self._seq_restaurado = seq
+
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        print(f"[journal_sesiones] {len(sesiones)} sesiones restauradas en {duracion_ms:.1f} ms "
+              f"({filas_journal} filas de journal)")
+        return sesiones
+
+    def cambio_desde_restauracion(self) -> bool:
+        """
+        True si alguien escribió en el journal después del último restaurar() de este objeto.
+        Un worker re-creado por gunicorn hereda las sesiones que el master restauró al
+        arrancar; con esto sabe si tiene que volver a leerlas.
+        """
+        if not self.habilitado:
+            return False
+        conn = self._conectar()
+        try:
+            return self._ultimo_seq(conn) > self._seq_restaurado
+        finally:
+            conn.close()
+
+    # ---------- Camino del webhook ----------
+
+    def registrar(self, visitor_id: str, session) -> None:
+        """
+        Encola el estado actual de la sesión (None = sesión eliminada).
+        Varias actualizaciones del mismo visitante entre flushes se colapsan en una.
+        """
+        if not self.habilitado:
+            return
+
+        if session is None:
+            fila = (visitor_id, None, None)
+        else:
+            expira = self.vencimiento(session) if self.vencimiento else None
+            fila = (visitor_id, pickle.dumps(session, pickle.HIGHEST_PROTOCOL), expira)
+        with self._lock:
+            self._pendientes[visitor_id] = fila
+        self._asegurar_hilo()
+
+    # ---------- Escritura en lotes ----------
+
+    def _asegurar_hilo(self) -> None:
+        # Tras un fork (workers pre-fork) el hilo del padre no existe en el hijo.
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="journal-sesiones", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self) -> None:
+        conn = self._conectar()
+        try:
+            while not self._detener.wait(self.intervalo_flush):
+                self._escribir_pendientes(conn)
+            self._escribir_pendientes(conn)
+        finally:
+            conn.close()
+
+    def _escribir_pendientes(self, conn: sqlite3.Connection) -> int:
+        with self._lock:
+            if not self._pendientes:
+                return 0
+            lote, self._pendientes = self._pendientes, {}
+
+        try:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO journal (visitor_id, session, expira) VALUES (?, ?, ?)", lote.values())
+            conn.execute("COMMIT")
+        except Exception as e:
+            print("ERROR escribiendo journal de sesiones:", e)
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            # Reintentar en el próximo ciclo sin pisar actualizaciones más nuevas
+            with self._lock:
+                for visitor_id, fila in lote.items():
+                    self._pendientes.setdefault(visitor_id, fila)
+            return 0
+
+        self._filas_desde_compactacion += len(lote)
+        if self._filas_desde_compactacion >= self.umbral_compactacion:
+            self._compactar(conn)
+        return len(lote)
+
+    def _compactar(self, conn: sqlite3.Connection) -> None:
+        """Borra las filas reemplazadas, las sesiones eliminadas y las vencidas."""
+        try:
+            conn.execute(
+                f"DELETE FROM journal WHERE seq NOT IN ({ULTIMAS_FILAS}) OR session IS NULL OR expira < ?",
+                (time.time(),),
+            )
+            self._filas_desde_compactacion = 0
+        except Exception as e:
+            print("ERROR compactando journal de sesiones:", e)
+
+    def compactar(self) -> None:
+        """Compactación explícita (p. ej. desde un script de mantenimiento)."""
+        if not self.habilitado:
+            return
+        conn = self._conectar()
+        try:
+            self._compactar(conn)
+        finally:
+            conn.close()
+
+    def cerrar(self, timeout: float = 5.0) -> None:
+        """Detiene el hilo de escritura tras un último flush."""
+        if self._hilo is None or self._pid != os.getpid():
+            return
+        self._detener.set()
+        self._hilo.join(timeout)
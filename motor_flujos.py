@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import threading
+
+
+# ===================== MOTOR DE FLUJOS CONVERSACIONALES =====================
+#
+# Los flujos se definen en JSON (estados, prompts, transiciones) y referencian
+# por nombre a parsers / validadores / resúmenes / hooks registrados en código.
+# Al cargar, la definición se compila a una tabla {estado: función}, de modo
+# que cada mensaje se resuelve con un único lookup en diccionario.
+#
+# Tipos de estado:
+#   - "transicion": responde y pasa a `siguiente`.
+#   - "menu":       elige una opción por palabras contenidas en el texto normalizado.
+#   - "formulario": parser -> validador -> respuesta `incompleto` o `completo`.
+#   - "alias":      fija el estado a `estado` y procesa el mensaje con él.
+#
+# Una "salida" (transición) admite: siguiente, respuesta, reiniciar_datos,
+# resumen (nombre) y hook (nombre). La respuesta puede ser el nombre de una
+# entrada de "respuestas" o un objeto {"textos": [...], "input": ..., "action": ...}.
+# En los textos, {faltantes} y {resumen} se reemplazan al responder.
+
+
+class ErrorFlujo(ValueError):
+    """Definición de flujo inválida (estado, parser, hook o respuesta inexistente)."""
+
+
+class MotorFlujos:
+    def __init__(self, ruta: str, registro: dict, normalizar=None, intervalo_recarga: float = 2.0):
+        """
+        registro: {"parsers": {...}, "validadores": {...}, "resumenes": {...}, "hooks": {...}}
+        normalizar: función usada para comparar opciones de menú (minúsculas, sin acentos).
+        intervalo_recarga: cada cuántos segundos, como máximo, se revisa si el archivo cambió
+                           (0 deshabilita la recarga en caliente).
+        """
+        self.ruta = ruta
+        self.registro = registro
+        self.normalizar = normalizar or (lambda s: (s or "").lower().strip())
+        self.intervalo_recarga = intervalo_recarga
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._proxima_revision = 0.0
+        self._tabla = {}
+        self._eventos = {}
+        self._por_defecto = None
+        self._formularios = {}
+        self.version = None
+
+        self.recargar()
+
+    # ---------- Carga / recarga en caliente ----------
+
+    def recargar(self) -> None:
+        """Lee y compila la definición. Si falla, se mantiene la versión anterior."""
+        with self._lock:
+            mtime = os.path.getmtime(self.ruta)
+            with open(self.ruta, encoding="utf-8") as f:
+                definicion = json.load(f)
+
+            tabla, eventos, por_defecto = self.compilar(definicion)
+            formularios = _formularios_por_estado(definicion, self.registro)
+
+            # Un único swap de referencias: los requests en curso terminan con la tabla anterior
+            self._tabla, self._eventos, self._por_defecto = tabla, eventos, por_defecto
+            self._formularios = formularios
+            self._mtime = mtime
+            self.version = definicion.get("version")
+            print(f"[motor_flujos] Flujos cargados desde {self.ruta} (version={self.version}, estados={len(tabla)})")
+
+    def revision_pendiente(self) -> bool:
+        """True si a recargar_si_cambio() le toca mirar el archivo."""
+        return bool(self.intervalo_recarga) and time.monotonic() >= self._proxima_revision
+
+    def recargar_si_cambio(self) -> None:
+        if not self.intervalo_recarga:
+            return
+        ahora = time.monotonic()
+        if ahora < self._proxima_revision:
+            return
+        self._proxima_revision = ahora + self.intervalo_recarga
+
+        try:
+            if os.path.getmtime(self.ruta) == self._mtime:
+                return
+            self.recargar()
+        except Exception as e:
+            print("ERROR recargando flujos; se mantiene la versión anterior:", e)
+
+    # ---------- Despacho ----------
+
+    def procesar(self, session: dict, handler: str, texto: str = "") -> dict:
+        if handler == "message":
+            estado = session.get("state", "inicio")
+            return self._tabla.get(estado, self._por_defecto)(session, texto)
+
+        evento = self._eventos.get(handler) or self._eventos["*"]
+        return evento(session, texto)
+
+    def es_formulario(self, estado: str) -> bool:
+        """True si en `estado` el visitante envía un bloque de datos (formulario o alias a uno)."""
+        return estado in self._formularios
+
+    def completaria_formulario(self, session: dict, texto: str) -> bool:
+        """
+        True si la sesión está en un formulario y `texto` lo deja sin faltantes.
+        Parser y validador se prueban sobre una copia de los datos: la sesión no cambia.
+        """
+        formulario = self._formularios.get(session.get("state"))
+        if formulario is None:
+            return False
+        parser, validador = formulario
+        data = dict(session.get("data") or {})
+        data.update(parser(data, texto))
+        return not validador(data)
+
+    # ---------- Compilación ----------
+
+    def compilar(self, definicion: dict):
+        respuestas = definicion.get("respuestas") or {}
+        estados = definicion.get("estados") or {}
+        if not estados:
+            raise ErrorFlujo("La definición no tiene estados.")
+
+        def obtener(tipo: str, nombre: str):
+            funciones = self.registro.get(tipo) or {}
+            if nombre not in funciones:
+                raise ErrorFlujo(f"{tipo}: '{nombre}' no está registrado.")
+            return funciones[nombre]
+
+        def compilar_respuesta(spec):
+            if isinstance(spec, str):
+                if spec not in respuestas:
+                    raise ErrorFlujo(f"Respuesta '{spec}' no definida.")
+                spec = respuestas[spec]
+
+            textos = list(spec.get("textos") or [])
+            action = spec.get("action", "reply")
+            input_card = spec.get("input")
+            con_variables = any("{" in t for t in textos)
+
+            def construir(variables: dict) -> dict:
+                if con_variables:
+                    replies = [_sustituir(t, variables) for t in textos]
+                else:
+                    replies = list(textos)
+                response = {"action": action, "replies": replies}
+                if input_card is not None:
+                    response["input"] = input_card
+                return response
+
+            return construir
+
+        def compilar_salida(spec: dict, origen: str):
+            siguiente = spec.get("siguiente")
+            if siguiente is not None and siguiente not in estados:
+                raise ErrorFlujo(f"{origen}: estado siguiente '{siguiente}' no definido.")
+            reiniciar = bool(spec.get("reiniciar_datos"))
+            resumen = obtener("resumenes", spec["resumen"]) if spec.get("resumen") else None
+            hook = obtener("hooks", spec["hook"]) if spec.get("hook") else None
+            construir = compilar_respuesta(spec.get("respuesta") or {})
+
+            def salida(session: dict, variables: dict) -> dict:
+                data = session.setdefault("data", {})
+                if resumen is not None:
+                    variables["resumen"] = resumen(data)
+                if hook is not None:
+                    hook(data)
+                if siguiente is not None:
+                    session["state"] = siguiente
+                if reiniciar:
+                    session["data"] = {}
+                return construir(variables)
+
+            return salida
+
+        def compilar_estado(nombre: str, spec: dict):
+            tipo = spec.get("tipo")
+
+            if tipo == "transicion":
+                salida = compilar_salida(spec, nombre)
+                return lambda session, texto: salida(session, {})
+
+            if tipo == "menu":
+                opciones = [
+                    (tuple(self.normalizar(p) for p in op.get("contiene") or []), compilar_salida(op, nombre))
+                    for op in spec.get("opciones") or []
+                ]
+                defecto = compilar_salida(spec.get("defecto") or {}, nombre)
+
+                def menu(session, texto):
+                    texto_norm = self.normalizar(texto)
+                    for palabras, salida in opciones:
+                        if any(p in texto_norm for p in palabras):
+                            return salida(session, {})
+                    return defecto(session, {})
+
+                return menu
+
+            if tipo == "formulario":
+                parser = obtener("parsers", spec["parser"])
+                validador = obtener("validadores", spec["validador"])
+                incompleto = compilar_salida(spec.get("incompleto") or {}, nombre)
+                completo = compilar_salida(spec.get("completo") or {}, nombre)
+
+                def formulario(session, texto):
+                    data = session.setdefault("data", {})
+                    data.update(parser(data, texto))
+                    faltantes = validador(data)
+                    if faltantes:
+                        return incompleto(session, {"faltantes": "\n- ".join(faltantes)})
+                    return completo(session, {})
+
+                return formulario
+
+            if tipo == "alias":
+                destino = spec.get("estado")
+                if destino not in estados or estados[destino].get("tipo") == "alias":
+                    raise ErrorFlujo(f"{nombre}: alias a estado inválido '{destino}'.")
+                return destino
+
+            raise ErrorFlujo(f"{nombre}: tipo de estado desconocido '{tipo}'.")
+
+        tabla = {}
+        alias = {}
+        for nombre, spec in estados.items():
+            compilado = compilar_estado(nombre, spec)
+            if isinstance(compilado, str):
+                alias[nombre] = compilado
+            else:
+                tabla[nombre] = compilado
+
+        for nombre, destino in alias.items():
+            tabla[nombre] = _compilar_alias(destino, tabla[destino])
+
+        eventos = {
+            evento: (lambda salida: (lambda session, texto: salida(session, {})))(compilar_salida(spec, evento))
+            for evento, spec in (definicion.get("eventos") or {}).items()
+        }
+        if "*" not in eventos:
+            eventos["*"] = lambda session, texto: compilar_respuesta({})({})
+
+        if not definicion.get("estado_desconocido"):
+            raise ErrorFlujo("Falta 'estado_desconocido' (salida para estados sin definición).")
+        salida_defecto = compilar_salida(definicion["estado_desconocido"], "estado_desconocido")
+        por_defecto = lambda session, texto: salida_defecto(session, {})
+
+        return tabla, eventos, por_defecto
+
+
+def _formularios_por_estado(definicion: dict, registro: dict) -> dict:
+    """{estado: (parser, validador)} de los formularios y de los alias a uno (definición ya compilada)."""
+    estados = definicion.get("estados") or {}
+    formularios = {}
+    for nombre, spec in estados.items():
+        if spec.get("tipo") == "alias":
+            spec = estados.get(spec.get("estado")) or {}
+        if spec.get("tipo") == "formulario":
+            formularios[nombre] = (registro["parsers"][spec["parser"]], registro["validadores"][spec["validador"]])
+    return formularios
+
+
+def _compilar_alias(destino: str, funcion):
+    def alias(session, texto):
+        session["state"] = destino
+        return funcion(session, texto)
+
+    return alias
+
+
+def _sustituir(texto: str, variables: dict) -> str:
+    for clave, valor in variables.items():
+        texto = texto.replace("{" + clave + "}", str(valor))
+    return texto
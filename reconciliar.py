@@ -0,0 +1,505 @@
+"""
+Conciliación de cotizaciones (o casos de postventa) contra Zoho CRM y recreación de los
+que se perdieron.
+
+Fuentes (se detecta el formato por línea):
+  - El log de la app exportado del log drain (o `heroku logs`): el webhook escribe cada
+    cotización como "CAPTURA_COTIZACION {json}" (y cada caso como "CAPTURA_POSTVENTA {json}");
+    el prefijo del drain ("<fecha> app[web.1]: ") se ignora y el resto de las líneas del log
+    se omiten. También sirve la copia en archivo si se configuró COTIZACIONES_CAPTURA_PATH /
+    POSTVENTA_CAPTURA_PATH: {"ts": ..., "huella": ..., "campos": {...}}
+  - Logs de payloads de SalesIQ ({"handler": ..., "visitor": ..., "message": ...} o
+    {"ts": ..., "payload": {...}}): se reproducen con el motor de flujos para reconstruir
+    los envíos completos, sin llamar a Zoho.
+
+Los Deals con Lead_Source = "Chat Whatsapp" se descargan completos con la Bulk Read API
+(un job por página de hasta 200.000 registros; requiere el scope ZohoCRM.bulk.read) y se
+comparan por huella (RUT + número de parte + marca + cantidad), tomada de la línea
+"Huella:" de la descripción del Deal; los Deals anteriores a esa línea se comparan
+recalculándola desde los campos de la descripción. Si la descarga falla no se recrea nada: comparar contra un listado parcial
+duplicaría Deals.
+Para las que faltan se resuelven/crean los Accounts y se crean los Deals con inserciones
+multi-registro de hasta 100, en paralelo y con un límite de llamadas por minuto.
+
+Con --postventa se hace lo mismo con los Cases (Case_Origin = "Chat Whatsapp", huella de
+RUT + factura + nombre + detalle, también guardada en la línea "Huella:" del caso): los lotes que la cola de postventa no pudo insertar
+se recuperan así. Como en el webhook, el caso se asocia al Account existente del RUT.
+
+Uso:
+  python reconciliar.py app.log [otros.log ...] [--dry-run] [--salida faltantes.jsonl]
+  python reconciliar.py --postventa app.log [--dry-run]
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# La CLI no usa las sesiones del servidor: no restaurar el journal al importar ServerHook
+os.environ["SESSION_JOURNAL_PATH"] = ""
+
+import requests
+
+import ServerHook as hook
+from motor_flujos import MotorFlujos
+from rut import normalizar_rut
+
+LEAD_SOURCE = "Chat Whatsapp"
+CASE_ORIGIN = "Chat Whatsapp"
+TAM_LOTE = 100          # máximo de Zoho por inserción multi-registro
+# https://www.zohoapis.com/crm/v2.1 -> https://www.zohoapis.com/crm/bulk/v2.1
+BULK_BASE = hook.CRM_BASE.rsplit("/crm/", 1)[0] + "/crm/bulk/v2.1"
+BULK_ESPERA_SEG = float(os.environ.get("BULK_ESPERA_SEG", 5))
+BULK_TIMEOUT_SEG = float(os.environ.get("BULK_TIMEOUT_SEG", 900))
+
+# Etiquetas de la descripción del Deal (construir_deal_data) -> campos de la cotización
+ETIQUETAS_DESCRIPCION = {
+    "Empresa": "empresa",
+    "RUT": "rut",
+    "Producto / descripción": "num_parte",
+    "Marca": "marca",
+    "Cantidad": "cantidad",
+}
+
+# Etiquetas de la descripción del Case (construir_case_data) -> campos de la postventa
+ETIQUETAS_CASE = {
+    "Nombre": "nombre",
+    "RUT": "rut",
+    "Número de factura": "numero_factura",
+    "Descripción del problema": "detalle",
+}
+VALORES_VACIOS = ("None", "(sin detalle adicional)")
+
+
+class LimitadorTasa:
+    """Reparte las llamadas a Zoho de todos los hilos en `por_minuto` llamadas por minuto."""
+
+    def __init__(self, por_minuto: float):
+        self.intervalo = 60.0 / por_minuto if por_minuto > 0 else 0.0
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def esperar(self) -> None:
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._proxima)
+            self._proxima = turno + self.intervalo
+            self.llamadas += 1
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+# ===================== Lectura de envíos =====================
+
+def reproductor_de_payloads(postventa: bool = False):
+    """Motor de flujos aislado cuyo hook de cotización (o de postventa) solo captura los datos completos."""
+    completas = []
+    capturar = lambda data: completas.append(dict(data))
+    ignorar = lambda data: None
+    hooks = dict(hook.REGISTRO_FLUJOS["hooks"],
+                 registrar_cotizacion=ignorar if postventa else capturar,
+                 registrar_postventa=capturar if postventa else ignorar)
+    motor = MotorFlujos(hook.motor_flujos.ruta, dict(hook.REGISTRO_FLUJOS, hooks=hooks),
+                        normalizar=hook.normalizar_texto)
+    return motor, completas
+
+
+def leer_envios(rutas: list, postventa: bool = False) -> list:
+    """Devuelve [{"ts", "huella", "campos"}] sin repetir huellas (se conserva el primero)."""
+    motor, completas = reproductor_de_payloads(postventa)
+    huella = hook.huella_postventa if postventa else hook.huella_cotizacion
+    etiqueta, otra_etiqueta = hook.ETIQUETA_CAPTURA_COTIZACION, hook.ETIQUETA_CAPTURA_POSTVENTA
+    if postventa:
+        etiqueta, otra_etiqueta = otra_etiqueta, etiqueta
+    sesiones = {}
+    envios = []
+    omitidas = 0
+
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                if etiqueta in linea:
+                    linea = linea.split(etiqueta, 1)[1]
+                elif otra_etiqueta in linea:
+                    continue
+                try:
+                    obj = json.loads(linea)
+                except ValueError:
+                    omitidas += 1
+                    continue
+                if not isinstance(obj, dict):
+                    omitidas += 1
+                    continue
+
+                if "campos" in obj:
+                    envios.append({"ts": obj.get("ts"), "campos": obj["campos"]})
+                    continue
+
+                payload = obj.get("payload") or obj
+                if "handler" not in payload:
+                    omitidas += 1
+                    continue
+                visitor_id = hook.get_visitor_id(payload)
+                session = sesiones.setdefault(visitor_id, {"state": "inicio", "data": {}})
+                handler = payload.get("handler")
+                texto = hook.extraer_mensaje(payload) if handler == "message" else ""
+                motor.procesar(session, handler, texto)
+                while completas:
+                    envios.append({"ts": obj.get("ts"), "campos": completas.pop(0)})
+
+    if omitidas:
+        print(f"[reconciliar] {omitidas} líneas sin captura ni payload omitidas.")
+
+    unicos = {}
+    for envio in envios:
+        envio["huella"] = huella(envio["campos"])
+        unicos.setdefault(envio["huella"], envio)
+    return list(unicos.values())
+
+
+# ===================== Deals existentes =====================
+
+def campos_de_descripcion(descripcion: str, etiquetas: dict = ETIQUETAS_DESCRIPCION) -> dict:
+    campos = {}
+    for linea in (descripcion or "").splitlines():
+        etiqueta, _, valor = linea.partition(":")
+        clave = etiquetas.get(etiqueta.strip())
+        if clave:
+            valor = valor.strip()
+            campos[clave] = "" if valor in VALORES_VACIOS else valor
+    return campos
+
+
+def huella_de_descripcion(descripcion: str, etiquetas: dict, huella) -> str:
+    """Huella de la línea "Huella:" del registro; si no la tiene, se recalcula desde los campos."""
+    campos = campos_de_descripcion(descripcion, dict(etiquetas, Huella="huella"))
+    return campos.get("huella") or huella(campos)
+
+
+def criterio_bulk(campo: str, valor: str, desde: str = None) -> dict:
+    """Criterio de la Bulk Read API: campo = valor (opcionalmente creados desde una fecha)."""
+    criterio = {"api_name": campo, "comparator": "equal", "value": valor}
+    if desde:
+        criterio = {"group_operator": "and", "group": [
+            criterio,
+            {"api_name": "Created_Time", "comparator": "greater_equal", "value": desde},
+        ]}
+    return criterio
+
+
+def esperar_job_bulk(job_id: str, headers: dict, limitador: LimitadorTasa) -> dict:
+    """Consulta el job hasta que termina; devuelve su `result` (page, count, more_records)."""
+    limite = time.monotonic() + BULK_TIMEOUT_SEG
+    while True:
+        limitador.esperar()
+        resp = requests.get(f"{BULK_BASE}/read/{job_id}", headers=headers, timeout=30)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Error consultando job bulk {job_id}: {resp.status_code} {resp.text}")
+        job = (resp.json().get("data") or [{}])[0]
+        estado = job.get("state")
+        if estado == "COMPLETED":
+            return job.get("result") or {}
+        if estado not in ("ADDED", "QUEUED", "IN PROGRESS"):
+            raise RuntimeError(f"Job bulk {job_id} terminó en estado {estado!r}: {job}")
+        if time.monotonic() > limite:
+            raise RuntimeError(f"Job bulk {job_id} sin terminar tras {BULK_TIMEOUT_SEG:.0f} s")
+        time.sleep(BULK_ESPERA_SEG)
+
+
+def descargar_bulk(modulo: str, campos: list, criterio: dict, headers: dict, limitador: LimitadorTasa):
+    """
+    Descarga todos los registros de `modulo` que cumplen `criterio` con la Bulk Read API.
+    Devuelve (filas, páginas); cada fila es un dict {campo: valor} leído del CSV del job.
+    Cualquier error lanza RuntimeError: nunca se devuelve un listado parcial.
+    """
+    filas, pagina = [], 1
+    while True:
+        query = {"module": {"api_name": modulo}, "fields": campos, "criteria": criterio, "page": pagina}
+        limitador.esperar()
+        resp = requests.post(f"{BULK_BASE}/read", headers=headers, json={"query": query}, timeout=30)
+        if resp.status_code not in (200, 201):
+            raise RuntimeError(f"Error creando job bulk de {modulo} (página {pagina}): {resp.status_code} {resp.text}")
+        job_id = resp.json()["data"][0]["details"]["id"]
+
+        resultado = esperar_job_bulk(job_id, headers, limitador)
+
+        limitador.esperar()
+        resp = requests.get(f"{BULK_BASE}/read/{job_id}/result", headers=headers, timeout=300)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Error descargando job bulk {job_id}: {resp.status_code} {resp.text}")
+        with zipfile.ZipFile(io.BytesIO(resp.content)) as archivo:
+            for nombre in archivo.namelist():
+                with archivo.open(nombre) as f:
+                    filas.extend(csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig", newline="")))
+
+        if not resultado.get("more_records"):
+            return filas, pagina
+        pagina += 1
+
+
+def descargar_huellas_deals(headers: dict, limitador: LimitadorTasa, desde: str = None):
+    """Descarga los Deals de WhatsApp. Devuelve ({huella: deal_id}, deals, páginas)."""
+    criterio = criterio_bulk("Lead_Source", LEAD_SOURCE, desde)
+    filas, paginas = descargar_bulk("Deals", ["Id", "Description"], criterio, headers, limitador)
+    huellas = {}
+    for deal in filas:
+        huellas.setdefault(huella_de_descripcion(deal.get("Description"), ETIQUETAS_DESCRIPCION, hook.huella_cotizacion),
+                           deal.get("Id"))
+    return huellas, len(filas), paginas
+
+
+def descargar_huellas_cases(headers: dict, limitador: LimitadorTasa, desde: str = None):
+    """Descarga los Cases de WhatsApp. Devuelve ({huella: case_id}, cases, páginas)."""
+    criterio = criterio_bulk("Case_Origin", CASE_ORIGIN, desde)
+    filas, paginas = descargar_bulk(hook.POSTVENTA_MODULO, ["Id", "Description"], criterio, headers, limitador)
+    huellas = {}
+    for case in filas:
+        huellas.setdefault(huella_de_descripcion(case.get("Description"), ETIQUETAS_CASE, hook.huella_postventa),
+                           case.get("Id"))
+    return huellas, len(filas), paginas
+
+
+def fecha_desde(envios: list):
+    """Inicio del día del envío más antiguo (None si alguno no trae fecha)."""
+    fechas = []
+    for envio in envios:
+        try:
+            fechas.append(datetime.fromisoformat(envio["ts"]))
+        except (TypeError, ValueError):
+            return None
+    if not fechas:
+        return None
+    return min(fechas).replace(hour=0, minute=0, second=0).isoformat(timespec="seconds")
+
+
+# ===================== Recreación =====================
+
+def en_lotes(items: list, tam: int) -> list:
+    return [items[i:i + tam] for i in range(0, len(items), tam)]
+
+
+def insertar_en_paralelo(modulo: str, registros: list, headers: dict, limitador: LimitadorTasa, pool) -> list:
+    """Inserta en lotes de TAM_LOTE en paralelo; devuelve los IDs creados (None si falló) en orden."""
+
+    def insertar(lote):
+        limitador.esperar()
+        resultados = hook.insertar_registros(modulo, lote, headers)
+        if resultados is None:
+            return [None] * len(lote)
+        ids = [(r.get("details") or {}).get("id") if r.get("status") == "success" else None for r in resultados]
+        return ids + [None] * (len(lote) - len(ids))
+
+    ids = []
+    for ids_lote in pool.map(insertar, en_lotes(registros, TAM_LOTE)):
+        ids.extend(ids_lote)
+    return ids
+
+
+def clave_account(campos: dict):
+    rut = normalizar_rut(campos.get("rut"))
+    if rut:
+        return rut
+    if (campos.get("rut") or "").strip():
+        return None  # RUT inválido: igual que el webhook, no se busca/crea Account
+    empresa = (campos.get("empresa") or "").strip()
+    return f"empresa:{empresa.lower()}" if empresa else None
+
+
+def resolver_accounts(faltantes: list, headers: dict, limitador: LimitadorTasa, pool, metricas: dict) -> dict:
+    """{clave_account: account_id}: busca por RUT en paralelo y crea en lote los que no existen."""
+    por_clave = {}
+    for envio in faltantes:
+        clave = clave_account(envio["campos"])
+        if clave:
+            por_clave.setdefault(clave, envio["campos"])
+
+    def buscar(clave):
+        if clave.startswith("empresa:"):
+            return clave, None
+        limitador.esperar()
+        return clave, hook.buscar_account_por_rut(clave, headers)
+
+    ids = {}
+    for clave, account_id in pool.map(buscar, list(por_clave)):
+        if account_id:
+            ids[clave] = account_id
+    metricas["accounts_existentes"] = len(ids)
+
+    por_crear = [c for c in por_clave if c not in ids]
+    registros = []
+    for clave in por_crear:
+        campos = por_clave[clave]
+        registros.append(hook.construir_account_data(
+            (campos.get("empresa") or "").strip(),
+            normalizar_rut(campos.get("rut")) or "",
+            (campos.get("telefono") or "").strip(),
+            random.choice(hook.OWNERS_POSIBLES),
+        ))
+    creados = insertar_en_paralelo("Accounts", registros, headers, limitador, pool)
+    for clave, account_id in zip(por_crear, creados):
+        if account_id:
+            ids[clave] = account_id
+    metricas["accounts_creados"] = sum(1 for a in creados if a)
+    metricas["accounts_fallidos"] = sum(1 for a in creados if not a)
+    return ids
+
+
+def crear_deals(faltantes: list, accounts: dict, headers: dict, limitador: LimitadorTasa, pool,
+                enviar_correos: bool, metricas: dict) -> None:
+    """Crea los Deals en lote (deja el deal_id en cada envío) y notifica a cada owner."""
+    registros, detalles = [], []
+    for envio in faltantes:
+        owner = random.choice(hook.OWNERS_POSIBLES)
+        account_id = accounts.get(clave_account(envio["campos"]))
+        deal_name, deal_data = hook.construir_deal_data(envio["campos"], owner, account_id)
+        registros.append(deal_data)
+        detalles.append((owner, deal_name))
+
+    ids = insertar_en_paralelo("Deals", registros, headers, limitador, pool)
+    for envio, deal_id in zip(faltantes, ids):
+        envio["deal_id"] = deal_id
+    metricas["deals_creados"] = sum(1 for d in ids if d)
+    metricas["deals_fallidos"] = sum(1 for d in ids if not d)
+
+    if not enviar_correos:
+        return
+
+    def notificar(args):
+        envio, (owner, deal_name) = args
+        limitador.esperar()
+        hook.enviar_correo_owner(owner, envio["deal_id"], deal_name, envio["campos"])
+
+    list(pool.map(notificar, [(e, d) for e, d in zip(faltantes, detalles) if e.get("deal_id")]))
+
+
+def crear_cases(faltantes: list, headers: dict, limitador: LimitadorTasa, pool, metricas: dict) -> None:
+    """Crea los Cases en lote (deja el case_id en cada envío), asociados al Account existente del RUT."""
+    ruts = {normalizar_rut(e["campos"].get("rut")) for e in faltantes} - {None}
+
+    def buscar(rut):
+        limitador.esperar()
+        return rut, hook.buscar_account_por_rut(rut, headers)
+
+    accounts = {rut: account_id for rut, account_id in pool.map(buscar, list(ruts)) if account_id}
+    metricas["accounts_existentes"] = len(accounts)
+
+    registros = [hook.construir_case_data(e["campos"], accounts.get(normalizar_rut(e["campos"].get("rut"))))
+                 for e in faltantes]
+    ids = insertar_en_paralelo(hook.POSTVENTA_MODULO, registros, headers, limitador, pool)
+    for envio, case_id in zip(faltantes, ids):
+        envio["case_id"] = case_id
+    metricas["cases_creados"] = sum(1 for c in ids if c)
+    metricas["cases_fallidos"] = sum(1 for c in ids if not c)
+
+
+# ===================== CLI =====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concilia cotizaciones (o casos de postventa) capturados contra Zoho "
+                                                 "y recrea los faltantes.")
+    parser.add_argument("entradas", nargs="+", help="Log de la app exportado del drain, archivo de captura "
+                                                    "o JSONL de payloads de SalesIQ")
+    parser.add_argument("--postventa", action="store_true", help="Conciliar casos de postventa contra Cases en vez de "
+                                                                 "cotizaciones contra Deals")
+    parser.add_argument("--dry-run", action="store_true", help="Solo comparar e informar; no escribe en Zoho")
+    parser.add_argument("--desde", help="Comparar solo contra registros creados desde esta fecha ISO "
+                                        "(por defecto, el día del envío más antiguo)")
+    parser.add_argument("--hilos", type=int, default=4, help="Llamadas a Zoho en paralelo")
+    parser.add_argument("--llamadas-por-minuto", type=float, default=100, help="Límite de llamadas a Zoho (0 = sin límite)")
+    parser.add_argument("--sin-correo", action="store_true", help="No enviar el correo al owner de los Deals recreados")
+    parser.add_argument("--salida", help="JSONL con los envíos faltantes (y el registro creado, si corresponde)")
+    args = parser.parse_args(argv)
+
+    if args.postventa:
+        tipo, modulo, origen = "casos de postventa", hook.POSTVENTA_MODULO, CASE_ORIGIN
+        descargar = descargar_huellas_cases
+    else:
+        tipo, modulo, origen = "cotizaciones", "Deals", LEAD_SOURCE
+        descargar = descargar_huellas_deals
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    envios = leer_envios(args.entradas, postventa=args.postventa)
+    tiempos["lectura"] = time.perf_counter() - inicio
+    print(f"[reconciliar] {len(envios)} {tipo} distintos leídos de {len(args.entradas)} archivo(s)")
+
+    access_token = hook.get_access_token()
+    if not access_token:
+        print("No se pudo obtener access token de Zoho.")
+        return 1
+    headers = {
+        "Authorization": f"Zoho-oauthtoken {access_token}",
+        "Content-Type": "application/json",
+    }
+
+    limitador = LimitadorTasa(args.llamadas_por_minuto)
+    desde = args.desde or fecha_desde(envios)
+
+    t = time.perf_counter()
+    try:
+        huellas_crm, existentes, paginas = descargar(headers, limitador, desde)
+    except (RuntimeError, requests.RequestException, zipfile.BadZipFile) as e:
+        print(f"[reconciliar] No se pudo descargar el listado completo de {modulo}; no se recrea nada: {e}")
+        return 1
+    tiempos["descarga"] = time.perf_counter() - t
+
+    faltantes = [e for e in envios if e["huella"] not in huellas_crm]
+    print(f"[reconciliar] {existentes} {modulo} '{origen}' en {paginas} página(s){f' desde {desde}' if desde else ''}; "
+          f"faltan {len(faltantes)} de {len(envios)} {tipo}")
+
+    metricas = {}
+    if faltantes and not args.dry_run:
+        with ThreadPoolExecutor(max_workers=args.hilos) as pool:
+            t = time.perf_counter()
+            if args.postventa:
+                crear_cases(faltantes, headers, limitador, pool, metricas)
+                tiempos["cases"] = time.perf_counter() - t
+            else:
+                accounts = resolver_accounts(faltantes, headers, limitador, pool, metricas)
+                tiempos["accounts"] = time.perf_counter() - t
+
+                t = time.perf_counter()
+                crear_deals(faltantes, accounts, headers, limitador, pool, not args.sin_correo, metricas)
+                tiempos["deals"] = time.perf_counter() - t
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            for envio in faltantes:
+                f.write(json.dumps(envio, ensure_ascii=False) + "\n")
+        print(f"Faltantes escritos en {args.salida}")
+
+    total = time.perf_counter() - inicio
+    print("\n===== Reporte =====")
+    print(f"Lectura:      {len(envios):7d} {tipo} en {tiempos['lectura']:6.2f} s "
+          f"({len(envios) / max(tiempos['lectura'], 1e-9):8.0f}/s)")
+    print(f"Descarga:     {existentes:7d} {modulo} en {tiempos['descarga']:6.2f} s "
+          f"({existentes / max(tiempos['descarga'], 1e-9):8.0f}/s, {paginas} página(s))")
+    print(f"Faltantes:    {len(faltantes):7d}{'  (dry-run: no se escribió en Zoho)' if args.dry_run else ''}")
+    if "accounts" in tiempos:
+        resueltos = metricas["accounts_existentes"] + metricas["accounts_creados"]
+        print(f"Accounts:     {metricas['accounts_existentes']:7d} existentes, {metricas['accounts_creados']} creados, "
+              f"{metricas['accounts_fallidos']} fallidos en {tiempos['accounts']:6.2f} s "
+              f"({resueltos / max(tiempos['accounts'], 1e-9):.1f}/s)")
+        print(f"Deals:        {metricas['deals_creados']:7d} creados, {metricas['deals_fallidos']} fallidos en "
+              f"{tiempos['deals']:6.2f} s ({metricas['deals_creados'] / max(tiempos['deals'], 1e-9):.1f}/s, incluye correos)")
+    if "cases" in tiempos:
+        print(f"Cases:        {metricas['cases_creados']:7d} creados, {metricas['cases_fallidos']} fallidos en "
+              f"{tiempos['cases']:6.2f} s ({metricas['accounts_existentes']} Accounts asociados)")
+    print(f"Llamadas Zoho:{limitador.llamadas:7d} (límite {args.llamadas_por_minuto:g}/min, {args.hilos} hilos)")
+    print(f"Total:        {total:.2f} s")
+
+    return 0 if not (metricas.get("deals_fallidos") or metricas.get("cases_fallidos")) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+RUT chileno: limpieza, validación del dígito verificador (módulo 11) y formato canónico.
+
+Formato canónico (el que se guarda en Billing_Code): cuerpo sin puntos + guión + DV
+en mayúscula, p. ej. "76123456-0".
+
+Uso como herramienta offline sobre una exportación del módulo Accounts:
+    python rut.py cuentas.csv [--salida cuentas_normalizadas.csv]
+"""
+import re
+import sys
+import csv
+import argparse
+
+# Miles separados por punto, espacio o nada: 76.123.456-0, 76 123 456-0, 761234560
+_FORMATO_RUT = re.compile(r"^\d{1,3}(?:[.\s]?\d{3}){1,2}\s*-?\s*[\dK]$")
+
+
+def limpiar_rut(texto: str) -> str:
+    """Deja solo dígitos y K (mayúscula): '76.123.456-k' => '76123456K'."""
+    return re.sub(r"[^\dK]", "", str(texto or "").upper())
+
+
+def calcular_dv(cuerpo: str) -> str:
+    """Dígito verificador módulo 11 para el cuerpo numérico del RUT."""
+    suma = 0
+    factor = 2
+    for digito in reversed(cuerpo):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - (suma % 11)
+    if resto == 11:
+        return "0"
+    if resto == 10:
+        return "K"
+    return str(resto)
+
+
+def normalizar_rut(texto: str):
+    """
+    Devuelve el RUT en formato canónico, o None si no tiene forma de RUT
+    (7-8 dígitos de cuerpo + DV) o el dígito verificador no corresponde.
+    """
+    s = str(texto or "").strip().upper()
+    if not _FORMATO_RUT.match(s):
+        return None
+
+    limpio = limpiar_rut(s)
+    cuerpo, dv = limpio[:-1], limpio[-1]
+    if not (7 <= len(cuerpo) <= 8) or "K" in cuerpo:
+        return None
+    if calcular_dv(cuerpo) != dv:
+        return None
+    return f"{int(cuerpo)}-{dv}"
+
+
+def es_rut_valido(texto: str) -> bool:
+    return normalizar_rut(texto) is not None
+
+
+def variantes_rut(canonico: str) -> list:
+    """Formas en que un RUT canónico puede estar escrito en registros antiguos del CRM."""
+    cuerpo, dv = canonico.split("-")
+    con_puntos = f"{int(cuerpo):,}".replace(",", ".")
+    return [canonico, f"{con_puntos}-{dv}", f"{cuerpo}{dv}"]
+
+
+# ===================== Validación en lote (Accounts) =====================
+
+def validar_lote(registros) -> dict:
+    """
+    registros: iterable de (id, billing_code).
+    Devuelve:
+      - filas: [{"id", "original", "normalizado", "estado", "duplicado_de"}]
+      - resumen: conteos por estado y cantidad de grupos duplicados
+    Estados: "canonico", "normalizado", "invalido", "vacio".
+    """
+    filas = []
+    primero_por_rut = {}
+    grupos_duplicados = set()
+
+    for registro_id, original in registros:
+        original = (original or "").strip()
+        normalizado = normalizar_rut(original) if original else None
+
+        if not original:
+            estado = "vacio"
+        elif normalizado is None:
+            estado = "invalido"
+        elif normalizado == original:
+            estado = "canonico"
+        else:
+            estado = "normalizado"
+
+        duplicado_de = ""
+        if normalizado:
+            if normalizado in primero_por_rut:
+                duplicado_de = primero_por_rut[normalizado]
+                grupos_duplicados.add(normalizado)
+            else:
+                primero_por_rut[normalizado] = registro_id
+
+        filas.append({
+            "id": registro_id,
+            "original": original,
+            "normalizado": normalizado or "",
+            "estado": estado,
+            "duplicado_de": duplicado_de,
+        })
+
+    resumen = {"total": len(filas), "grupos_duplicados": len(grupos_duplicados)}
+    for estado in ("canonico", "normalizado", "invalido", "vacio"):
+        resumen[estado] = sum(1 for f in filas if f["estado"] == estado)
+    resumen["duplicados"] = sum(1 for f in filas if f["duplicado_de"])
+
+    return {"filas": filas, "resumen": resumen}
+
+
+def _columna(encabezados, candidatos):
+    normalizados = {h.strip().lower().replace("_", " "): h for h in encabezados}
+    for candidato in candidatos:
+        if candidato in normalizados:
+            return normalizados[candidato]
+    return None
+
+
+def leer_export_accounts(ruta: str):
+    """Lee una exportación CSV de Accounts (encabezados de la UI o nombres de API)."""
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        lector = csv.DictReader(f)
+        col_id = _columna(lector.fieldnames or [], ["record id", "id"])
+        col_rut = _columna(lector.fieldnames or [], ["billing code", "billing_code"])
+        if not col_id or not col_rut:
+            raise ValueError("El CSV debe tener columnas 'Record Id' / 'id' y 'Billing Code' / 'Billing_Code'.")
+        for fila in lector:
+            yield fila[col_id], fila[col_rut]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normaliza y deduplica Billing_Code (RUT) de Accounts exportados.")
+    parser.add_argument("csv", help="Exportación de Accounts (CSV)")
+    parser.add_argument("--salida", help="CSV de salida con el RUT normalizado y duplicados")
+    args = parser.parse_args(argv)
+
+    resultado = validar_lote(leer_export_accounts(args.csv))
+    resumen = resultado["resumen"]
+
+    print(f"Accounts:                {resumen['total']}")
+    print(f"  RUT canónico:          {resumen['canonico']}")
+    print(f"  RUT a normalizar:      {resumen['normalizado']}")
+    print(f"  RUT inválido:          {resumen['invalido']}")
+    print(f"  Sin RUT:               {resumen['vacio']}")
+    print(f"Duplicados:              {resumen['duplicados']} ({resumen['grupos_duplicados']} RUT distintos)")
+
+    if args.salida:
+        with open(args.salida, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.DictWriter(f, fieldnames=["id", "original", "normalizado", "estado", "duplicado_de"])
+            escritor.writeheader()
+            escritor.writerows(resultado["filas"])
+        print(f"Detalle escrito en {args.salida}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
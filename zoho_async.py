@@ -0,0 +1,218 @@
+import time
+import random
+import asyncio
+
+import httpx
+
+import ServerHook as hook
+from rut import normalizar_rut, variantes_rut
+
+
+class ClienteZohoAsync:
+    """
+    Versión no bloqueante de las llamadas a Zoho de ServerHook, sobre un único
+    httpx.AsyncClient con pool de conexiones (keep-alive) compartido por todas
+    las conversaciones del proceso. Reutiliza los mismos payloads (construir_*).
+    """
+
+    def __init__(self, max_conexiones: int = 100, timeout: float = 10.0):
+        self._http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_conexiones, max_keepalive_connections=max_conexiones),
+        )
+        # Parte del token obtenido en el arranque (ServerHook.precalentar), si lo hay
+        self._token = hook.access_token_cache["token"]
+        self._token_expira = hook.access_token_cache["expires_at"]
+        self._token_lock = asyncio.Lock()
+
+    async def cerrar(self) -> None:
+        await self._http.aclose()
+
+    # ---------- OAuth ----------
+
+    async def access_token(self):
+        if self._token and self._token_expira - 60 > time.time():
+            return self._token
+
+        # Un solo refresh aunque haya muchas conversaciones esperando token
+        async with self._token_lock:
+            if self._token and self._token_expira - 60 > time.time():
+                return self._token
+
+            params = hook.parametros_refresh_token()
+            if params is None:
+                return None
+
+            try:
+                resp = await self._http.post(f"{hook.ACCOUNTS_BASE}/oauth/v2/token", params=params)
+                print("=== Respuesta refresh token Zoho (async) ===")
+                print(resp.status_code, resp.text)
+                if resp.status_code != 200:
+                    return None
+                data = resp.json()
+            except Exception as e:
+                print("ERROR llamando a Zoho Accounts (async):", e)
+                return None
+
+            token = data.get("access_token")
+            if not token:
+                print("ERROR: respuesta sin access_token.")
+                return None
+
+            self._token = token
+            self._token_expira = time.time() + int(data.get("expires_in", 3600))
+            return token
+
+    async def _headers(self):
+        token = await self.access_token()
+        if not token:
+            return None
+        return {"Authorization": f"Zoho-oauthtoken {token}", "Content-Type": "application/json"}
+
+    async def _post(self, etiqueta: str, url: str, headers: dict, payload: dict):
+        try:
+            resp = await self._http.post(url, headers=headers, json=payload)
+            print(f"=== Respuesta Zoho CRM ({etiqueta}) ===")
+            print(resp.status_code, resp.text)
+            return resp
+        except Exception as e:
+            print(f"ERROR llamando a Zoho CRM ({etiqueta}):", e)
+            return None
+
+    async def insertar_registros(self, modulo: str, registros: list, headers: dict, reintentos: int = 4):
+        """Equivalente async de ServerHook.insertar_registros (multi-registro, backoff ante 429/5xx)."""
+        url = f"{hook.CRM_BASE}/{modulo}"
+        for intento in range(reintentos):
+            resp = await self._post(f"{modulo}, lote de {len(registros)}", url, headers, {"data": registros})
+
+            # 207 = Multi-Status: algunos registros insertados y otros rechazados
+            if resp is not None and resp.status_code in (200, 201, 202, 207):
+                try:
+                    return resp.json().get("data") or []
+                except Exception:
+                    return []
+
+            if resp is not None and resp.status_code not in (429, 500, 502, 503, 504):
+                break
+            await asyncio.sleep(2 ** intento)
+
+        return None
+
+    # ---------- Accounts ----------
+
+    async def buscar_account_por_rut(self, rut: str, headers: dict):
+        criteria = "(" + "or".join(f"(Billing_Code:equals:{v})" for v in variantes_rut(rut)) + ")"
+        try:
+            resp = await self._http.get(f"{hook.CRM_BASE}/Accounts/search", headers=headers, params={"criteria": criteria})
+            print("=== Búsqueda Account por Billing_Code (async) ===")
+            print(resp.status_code, resp.text)
+            if resp.status_code == 200:
+                registros = resp.json().get("data") or []
+                if registros and registros[0].get("id"):
+                    return registros[0]["id"]
+        except Exception as e:
+            print("ERROR buscando Account (async):", e)
+        return None
+
+    async def obtener_o_crear_account(self, campos: dict):
+        rut_original = (campos.get("rut") or "").strip()
+        rut = normalizar_rut(rut_original) or ""
+        if rut_original and not rut:
+            print(f"[obtener_o_crear_account] RUT inválido {rut_original!r}; no se busca/crea Account.")
+            return None
+
+        empresa = (campos.get("empresa") or "").strip()
+        telefono = (campos.get("telefono") or "").strip()
+        if not rut and not empresa:
+            return None
+
+        headers = await self._headers()
+        if headers is None:
+            print("No se pudo obtener access token; se omite Accounts.")
+            return None
+
+        if rut:
+            account_id = await self.buscar_account_por_rut(rut, headers)
+            if account_id:
+                return account_id
+
+        owner = random.choice(hook.OWNERS_POSIBLES)
+        account_data = hook.construir_account_data(empresa, rut, telefono, owner)
+        resp = await self._post("Accounts", f"{hook.CRM_BASE}/Accounts", headers, {"data": [account_data]})
+        return hook.id_registro_creado(resp)
+
+    # ---------- Deals ----------
+
+    async def crear_deal(self, campos: dict, account_id: str = None):
+        """Crea el Deal y envía el correo al owner. Devuelve el ID del Deal o None."""
+        headers = await self._headers()
+        if headers is None:
+            print("No se pudo obtener access token de Zoho; se omite creación de Deal.")
+            return None
+
+        owner = random.choice(hook.OWNERS_POSIBLES)
+        deal_name, deal_data = hook.construir_deal_data(campos, owner, account_id)
+        resp = await self._post("Deals", f"{hook.CRM_BASE}/Deals", headers, {"data": [deal_data]})
+        deal_id = hook.id_registro_creado(resp)
+
+        if deal_id:
+            correo = hook.construir_correo_owner(owner, deal_id, deal_name, campos)
+            if correo is not None:
+                await self._post("send_mail", f"{hook.CRM_BASE}/Deals/{deal_id}/actions/send_mail", headers, correo)
+        return deal_id
+
+    async def agregar_nota_a_deal(self, deal_id: str, campos: dict):
+        headers = await self._headers()
+        if headers is None:
+            return None
+        return await self._post("Notes", f"{hook.CRM_BASE}/Deals/{deal_id}/Notes", headers, hook.construir_nota_repetida(campos))
+
+    # ---------- Cases (postventa) ----------
+
+    async def _account_de_rut(self, rut: str, headers: dict):
+        account_id = hook.accounts_por_rut.buscar(rut)
+        if account_id is None:
+            account_id = await self.buscar_account_por_rut(rut, headers)
+            if account_id:
+                hook.accounts_por_rut.registrar(rut, account_id)
+        return account_id
+
+    async def insertar_cases_en_lote(self, lote: list) -> None:
+        """Equivalente async de ServerHook.insertar_cases_en_lote: Accounts por RUT en paralelo + una inserción."""
+        headers = await self._headers()
+        if headers is None:
+            print(f"[insertar_cases_en_lote] Sin access token; {len(lote)} casos de postventa sin crear "
+                  f"({hook.POSTVENTA_RECUPERACION}).")
+            return
+
+        ruts = sorted({normalizar_rut(campos.get("rut")) for campos in lote} - {None})
+        accounts = dict(zip(ruts, await asyncio.gather(*(self._account_de_rut(rut, headers) for rut in ruts))))
+        registros = [hook.construir_case_data(campos, accounts.get(normalizar_rut(campos.get("rut")))) for campos in lote]
+
+        resultados = await self.insertar_registros(hook.POSTVENTA_MODULO, registros, headers,
+                                                   reintentos=hook.POSTVENTA_REINTENTOS)
+        if resultados is None:
+            print(f"[insertar_cases_en_lote] No se pudo insertar lote de {len(registros)} casos "
+                  f"({hook.POSTVENTA_RECUPERACION}): {registros}")
+            return
+
+        for registro, resultado in zip(registros, resultados):
+            if resultado.get("status") != "success":
+                print(f"[insertar_cases_en_lote] Caso rechazado: {resultado} <- {registro}")
+
+    # ---------- Hook de cotización ----------
+
+    async def registrar_cotizacion(self, data: dict) -> None:
+        """Equivalente async de ServerHook.registrar_cotizacion (incluye captura y deduplicación)."""
+        await asyncio.to_thread(hook.capturar_cotizacion, data)
+        huella = hook.huella_cotizacion(data)
+        deal_existente = hook.cotizaciones_recientes.buscar(huella)
+        if deal_existente:
+            print(f"[registrar_cotizacion] Cotización repetida; se agrega nota al Deal {deal_existente}")
+            await self.agregar_nota_a_deal(deal_existente, data)
+            return
+
+        account_id = await self.obtener_o_crear_account(data)
+        deal_id = await self.crear_deal(data, account_id=account_id)
+        if deal_id:
+            hook.cotizaciones_recientes.registrar(huella, deal_id)